@@ -1,5 +1,4 @@
 # -*- coding: utf-8 -*-
-import io
 import math
 import copy
 import socket
@@ -10,18 +9,39 @@ from Face import *
 import numpy as np
 from Thread import *
 import multiprocessing
-from PIL import Image, ImageDraw
 from Command import COMMAND as cmd
+from Protocol import encode_text
+from Video import is_valid_jpeg, FrameSlot, DecoderPool
+try:
+    import av
+    H264_SUPPORTED=True
+except ImportError:
+    H264_SUPPORTED=False
+#Opt-in: the server has one encoder, so asking for H.264 switches every other viewer to it too
+H264_REQUESTED=False
+H264_BITRATE=1000           #kbit/s requested from the server
+H264_KEYFRAME_INTERVAL=30
 class Client:
     def __init__(self):
         self.face=Face()
         self.pid=Incremental_PID(1,0,0.0025)
         self.tcp_flag=False
+        self.binary_protocol=False
+        self.telemetry=False
         self.video_flag=True
         self.fece_id=False
         self.fece_recognition_flag = False
         self.image=''
+        self.h264_decoder=None
+        #Reader -> decoder pool -> latest-frame slot read by the UI
+        self.frame_slot=FrameSlot()
+        self.face_lock=threading.Lock()
+        self.jpeg_pool=DecoderPool(self.decode_jpeg,workers=2)
+        self.h264_pool=DecoderPool(self.decode_h264_frame,drop_stale=False)
     def turn_on_client(self,ip):
+        self.binary_protocol=False
+        self.telemetry=False
+        self.h264_decoder=None
         self.client_socket1 = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         self.client_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         print (ip)
@@ -33,17 +53,34 @@ class Client:
             self.client_socket1.close()
         except Exception as e:
             print(e)
-    def is_valid_image_4_bytes(self,buf): 
-        bValid = True
-        if buf[6:10] in (b'JFIF', b'Exif'):     
-            if not buf.rstrip(b'\0\r\n').endswith(b'\xff\xd9'):
-                bValid = False
-        else:        
-            try:  
-                Image.open(io.BytesIO(buf)).verify() 
-            except:  
-                bValid = False
-        return bValid
+    def is_h264(self,buf):
+        return buf[:4]==b'\x00\x00\x00\x01' or buf[:3]==b'\x00\x00\x01'
+    def decode_h264(self,buf):
+        #Each payload is one whole access unit, so it goes straight to the decoder without a parser delay
+        if self.h264_decoder is None:
+            self.h264_decoder=av.CodecContext.create('h264','r')
+        image=None
+        for frame in self.h264_decoder.decode(av.Packet(buf)):
+            image=frame.to_ndarray(format='bgr24')
+        return image
+    def publish_image(self,sequence,image):
+        #Runs on a decoder thread: face detection and colour conversion stay off the UI and socket threads
+        if self.fece_id == False and self.fece_recognition_flag:
+            with self.face_lock:
+                self.face.face_detect(image)
+        rgb=cv2.cvtColor(image,cv2.COLOR_BGR2RGB)
+        if self.frame_slot.put(sequence,(image,rgb)):
+            self.image=image
+            self.video_flag=False
+    def decode_jpeg(self,sequence,jpg):
+        image=cv2.imdecode(np.frombuffer(jpg,dtype=np.uint8),cv2.IMREAD_COLOR)
+        if image is not None:
+            self.publish_image(sequence,image)
+    def decode_h264_frame(self,sequence,buf):
+        #Every access unit must be decoded in order, even if the UI has not shown the last image
+        image=self.decode_h264(buf)
+        if image is not None:
+            self.publish_image(sequence,image)
     def receiving_video(self,ip):
         try:
             self.client_socket.connect((ip, 8002))
@@ -51,24 +88,28 @@ class Client:
         except:
             #print ("command port connect failed")
             pass
+        sequence=0
         while True:
             try:
                 stream_bytes= self.connection.read(4)
                 leng=struct.unpack('<L', stream_bytes[:4])
                 jpg=self.connection.read(leng[0])
-                if self.is_valid_image_4_bytes(jpg):
-                    if self.video_flag:
-                        self.image = cv2.imdecode(np.frombuffer(jpg, dtype=np.uint8), cv2.IMREAD_COLOR)
-                        if self.fece_id == False and self.fece_recognition_flag:
-                            self.face.face_detect(self.image)
-                        self.video_flag=False
+                sequence+=1
+                if self.is_h264(jpg):
+                    if H264_SUPPORTED:
+                        self.h264_pool.submit(sequence,jpg)
+                elif is_valid_jpeg(jpg):
+                    self.jpeg_pool.submit(sequence,jpg)
             except BaseException as e:
                 print (e)
                 break
     def send_data(self,data):
         if self.tcp_flag:
             try:
-                self.client_socket1.send(data.encode('utf-8'))
+                if self.binary_protocol:
+                    self.client_socket1.send(encode_text(data))
+                else:
+                    self.client_socket1.send(data.encode('utf-8'))
             except Exception as e:
                 print(e)
     def receive_data(self):
@@ -13,5 +13,9 @@ class COMMAND:
     CMD_CALIBRATION = "CMD_CALIBRATION"
     CMD_CAMERA = "CMD_CAMERA"
     CMD_SERVOPOWER = "CMD_SERVOPOWER"
+    CMD_PROTOCOL = "CMD_PROTOCOL"
+    CMD_VIDEO = "CMD_VIDEO"
+    CMD_TELEMETRY = "CMD_TELEMETRY"
+    CMD_IMU = "CMD_IMU"
     def __init__(self):
         pass
@@ -1,13 +1,22 @@
 import os
 import sys
+import json
+import hashlib
 import cv2
 import numpy as np
 class  Face:
-    def __init__(self):
+    def __init__(self, detect_interval=5, detect_scale=0.5):
         self.recognizer = cv2.face.LBPHFaceRecognizer_create()
         self.recognizer.read('Face/face.yml')
         self.detector = cv2.CascadeClassifier("Face/haarcascade_frontalface_default.xml")
         self.name = self.Read_from_txt('Face/name')
+        self.detect_interval = detect_interval  # Full Haar scan every N frames, tracking in between
+        self.detect_scale = detect_scale        # Full scans run on a downscaled image
+        self.track_margin = 0.5                 # Search window around a face, as a fraction of its size
+        self.track_threshold = 0.6              # Minimum template match score to keep a track
+        self.tracks = []                        # [x, y, w, h, label, template] per tracked face
+        self.frame_count = 0
+        self.tracks_lost = False                # Set when tracking drops a face, forces an early full scan
     def Read_from_txt(self, filename):
         file1 = open(filename + ".txt", "r")
         list_row = file1.readlines()
@@ -29,42 +38,132 @@ class  Face:
                 file2.write('\t')
             file2.write('\n')
         file2.close()
-    def getImagesAndLabels(self,path='Face'):
-        imagePaths = [os.path.join(path,f) for f in os.listdir(path)]
+    def load_cache_index(self, cache_dir):
+        try:
+            with open(os.path.join(cache_dir, 'index.json'), 'r') as file:
+                return json.load(file)
+        except (OSError, ValueError):
+            return {"images": {}, "trained": []}
+    def save_cache_index(self, cache_dir, index):
+        with open(os.path.join(cache_dir, 'index.json'), 'w') as file:
+            json.dump(index, file)
+    def image_samples(self, imagePath, index, cache_dir):
+        """
+        Return (key, face crops) for one photo, detecting faces only if this content was never seen.
+        The content hash is recomputed only when the file's size or mtime changed.
+        """
+        stat = os.stat(imagePath)
+        entry = index["images"].get(imagePath)
+        if entry is None or entry["mtime"] != stat.st_mtime or entry["size"] != stat.st_size:
+            with open(imagePath, 'rb') as file:
+                entry = {"mtime": stat.st_mtime, "size": stat.st_size, "sha1": hashlib.sha1(file.read()).hexdigest()}
+            index["images"][imagePath] = entry
+        key = entry["sha1"]
+        samples_path = os.path.join(cache_dir, key + '.npz')
+        if os.path.exists(samples_path):
+            with np.load(samples_path) as samples:
+                return key, [samples['arr_%d' % i] for i in range(len(samples.files))]
+        gray = cv2.cvtColor(cv2.imread(imagePath), cv2.COLOR_BGR2GRAY)
+        faces = self.detector.detectMultiScale(gray, scaleFactor=1.2, minNeighbors=5)
+        crops = [gray[y:y+h,x:x+w] for (x,y,w,h) in faces]
+        np.savez(samples_path, *crops)
+        return key, crops
+    def getImagesAndLabels(self,path='Face',index=None):
+        cache_dir = os.path.join(path, 'cache')
+        os.makedirs(cache_dir, exist_ok=True)
+        save_index = index is None
+        if index is None:
+            index = self.load_cache_index(cache_dir)
         faceSamples=[]
         labels = []
-        for imagePath in imagePaths:
-            if os.path.split(imagePath)[-1].split(".")[1]=="jpg":
-                id = int(os.path.split(imagePath)[-1].split(".")[0])
-                img = cv2.imread(imagePath)
-                gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
-                faces = self.detector.detectMultiScale(gray, scaleFactor=1.2, minNeighbors=5)
-                for (x,y,w,h) in faces:
-                    faceSamples.append(gray[y:y+h,x:x+w])
+        keys = []
+        seen = set()
+        for f in sorted(os.listdir(path)):
+            imagePath = os.path.join(path,f)
+            stem, ext = os.path.splitext(f)
+            if ext == ".jpg" and stem.isdigit():
+                id = int(stem)
+                key, crops = self.image_samples(imagePath, index, cache_dir)
+                seen.add(imagePath)
+                for crop in crops:
+                    faceSamples.append(crop)
                     labels.append(id)
-        return faceSamples,labels
-    def trainImage(self):
-        faces, labels = self.getImagesAndLabels()
-        self.recognizer.train(faces, np.array(labels))
-        self.recognizer.write('Face/face.yml')
-        self.recognizer.read('Face/face.yml')
+                    keys.append(str(id) + ':' + key)
+        #Forget photos that were deleted
+        index["images"] = {name: entry for name, entry in index["images"].items() if name in seen}
+        if save_index:
+            self.save_cache_index(cache_dir, index)
+        return faceSamples,labels,keys
+    def trainImage(self,path='Face'):
+        cache_dir = os.path.join(path, 'cache')
+        os.makedirs(cache_dir, exist_ok=True)
+        index = self.load_cache_index(cache_dir)
+        faces, labels, keys = self.getImagesAndLabels(path, index)
+        trained = set(index["trained"])
+        if trained and trained.issubset(keys) and os.path.exists(os.path.join(path, 'face.yml')):
+            #Only photos were added since the last run: extend the model instead of retraining it
+            new = [i for i, key in enumerate(keys) if key not in trained]
+            if new:
+                self.recognizer.update([faces[i] for i in new], np.array([labels[i] for i in new]))
+        else:
+            self.recognizer.train(faces, np.array(labels))
+        index["trained"] = sorted(set(keys))
+        self.recognizer.write(os.path.join(path, 'face.yml'))
+        self.save_cache_index(cache_dir, index)
         print("\n  {0} faces trained.".format(len(np.unique(labels))))
+    def detect_faces(self, gray):
+        """Run the Haar cascade on a downscaled copy of the frame and return boxes in full-size coordinates."""
+        scale = self.detect_scale
+        small = cv2.resize(gray, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA) if scale != 1 else gray
+        faces = self.detector.detectMultiScale(small, 1.2, 5)
+        return [(int(x / scale), int(y / scale), int(w / scale), int(h / scale)) for (x, y, w, h) in faces]
+    def recognize_batch(self, gray, boxes):
+        """Predict a label for each face box of one frame, one recognizer call per crop."""
+        crops = [gray[y:y + h, x:x + w] for (x, y, w, h) in boxes]
+        labels = []
+        for crop in crops:
+            id, confidence = self.recognizer.predict(crop)
+            labels.append("unknow" if confidence > 100 else self.name[int(id)][1])
+        return labels
+    def track_faces(self, gray):
+        """Follow each tracked face by template matching inside a window around its last box."""
+        height, width = gray.shape[:2]
+        tracks = []
+        for x, y, w, h, label, template in self.tracks:
+            mx, my = int(w * self.track_margin), int(h * self.track_margin)
+            x0, y0 = max(0, x - mx), max(0, y - my)
+            x1, y1 = min(width, x + w + mx), min(height, y + h + my)
+            window = gray[y0:y1, x0:x1]
+            if window.shape[0] < h or window.shape[1] < w:
+                continue
+            result = cv2.matchTemplate(window, template, cv2.TM_CCOEFF_NORMED)
+            _, score, _, (dx, dy) = cv2.minMaxLoc(result)
+            if score >= self.track_threshold:
+                nx, ny = x0 + dx, y0 + dy
+                tracks.append([nx, ny, w, h, label, gray[ny:ny + h, nx:nx + w].copy()])
+        self.tracks_lost = len(tracks) < len(self.tracks)
+        self.tracks = tracks
     def face_detect(self,img):
         try:
             if sys.platform.startswith('win') or sys.platform.startswith('darwin') or sys.platform.startswith('linux'):
                 gray = cv2.cvtColor(img,cv2.COLOR_BGR2GRAY)
-                faces = self.detector.detectMultiScale(gray,1.2,5)
-                if len(faces)>0 :
-                    for (x,y,w,h) in faces:
-                        cv2.rectangle(img, (x, y), (x+w, y+h), (0, 255, 0), 2)
-                        id, confidence = self.recognizer.predict(gray[y:y + h, x:x + w])
-                        #print("confidence",id,confidence)
-                        if confidence > 100:
-                            cv2.putText(img, str("unknow"), (x + 5, y + h + 30), cv2.FONT_HERSHEY_DUPLEX, 1,
-                                        (0, 255, 0), 2)
-                        else:
-                            cv2.putText(img, self.name[int(id)][1], (x + 5, y + h + 30), cv2.FONT_HERSHEY_DUPLEX, 1,
-                                        (0, 255, 0), 2)
+                full_scan = self.frame_count % self.detect_interval == 0
+                if not full_scan:
+                    self.track_faces(gray)
+                    #Rescan right away only on the frame a tracked face was lost, not whenever nothing is tracked
+                    full_scan = self.tracks_lost
+                if full_scan:
+                    #Full scan: find faces again and re-run recognition on them
+                    boxes = self.detect_faces(gray)
+                    labels = self.recognize_batch(gray, boxes)
+                    self.tracks = [[x, y, w, h, label, gray[y:y + h, x:x + w].copy()]
+                                   for (x, y, w, h), label in zip(boxes, labels)]
+                    self.tracks_lost = False
+                self.frame_count += 1
+                for x, y, w, h, label, template in self.tracks:
+                    cv2.rectangle(img, (x, y), (x+w, y+h), (0, 255, 0), 2)
+                    cv2.putText(img, label, (x + 5, y + h + 30), cv2.FONT_HERSHEY_DUPLEX, 1,
+                                (0, 255, 0), 2)
         except Exception as e:
             print(e)
 
@@ -10,6 +10,7 @@ from PyQt5.QtWidgets import *
 from PyQt5.QtGui import *
 from Client import *
 from Calibration import *
+from Protocol import PROTOCOL_VERSION
 class MyWindow(QMainWindow,Ui_client):
     def __init__(self):
         super(MyWindow,self).__init__()
@@ -465,8 +466,9 @@ class MyWindow(QMainWindow,Ui_client):
 
     def power(self):
         try:
-            command = cmd.CMD_POWER + '\n'
-            self.client.send_data(command)
+            if not self.client.telemetry:
+                command = cmd.CMD_POWER + '\n'
+                self.client.send_data(command)
             self.progress_Power1.setFormat(str(self.power_value[0])+"V")
             self.progress_Power2.setFormat(str(self.power_value[1]) + "V")
             self.progress_Power1.setValue(self.restriction(round((float(self.power_value[0]) - 5.00) / 3.40 * 100), 0, 100))
@@ -480,9 +482,16 @@ class MyWindow(QMainWindow,Ui_client):
             self.client.client_socket1.connect((ip,5002))
             self.client.tcp_flag=True
             print ("Connecttion Successful !")
+            self.client.send_data(cmd.CMD_PROTOCOL + '#' + str(PROTOCOL_VERSION) + '\n')
+            #Ask the server to push battery, sonar and IMU readings instead of polling for them
+            self.client.send_data(cmd.CMD_TELEMETRY + '#1\n')
+            if H264_REQUESTED and H264_SUPPORTED:
+                #Ask for H.264 video only when configured; without PyAV the server keeps sending MJPEG
+                self.client.send_data(cmd.CMD_VIDEO + '#1#' + str(H264_BITRATE) + '#' + str(H264_KEYFRAME_INTERVAL) + '\n')
         except Exception as e:
             print ("Connect to server Faild!: Server IP is right? Server is opend?")
             self.client.tcp_flag=False
+        pending=''
         while True:
             try:
                 alldata=self.client.receive_data()
@@ -493,19 +502,26 @@ class MyWindow(QMainWindow,Ui_client):
             if alldata=='':
                 break
             else:
-                cmdArray=alldata.split('\n')
+                cmdArray=(pending+alldata).split('\n')
                 #print(cmdArray)
-                if cmdArray[-1] !="":
-                    cmdArray==cmdArray[:-1]
+                #Keep a trailing partial line for the next read
+                pending=cmdArray.pop()
             for oneCmd in cmdArray:
                 data=oneCmd.split("#")
-                print(data)
+                #print(data)
                 if data=="":
                     self.client.tcp_flag=False
                     break
                 elif data[0]==cmd.CMD_SONIC:
-                    self.label_sonic.setText('Obstacle:'+data[1]+'cm')
+                    if self.Button_Sonic.text() == 'Close':
+                        self.label_sonic.setText('Obstacle:'+data[1]+'cm')
                     #print('Obstacle:',data[1])
+                elif data[0]==cmd.CMD_TELEMETRY:
+                    #Server pushes readings now, so the power and sonar timers stop polling
+                    self.client.telemetry = len(data)==2 and data[1]=='1'
+                elif data[0]==cmd.CMD_PROTOCOL:
+                    #Server supports binary framing, switch high-rate commands to it
+                    self.client.binary_protocol = len(data)==2 and data[1].isdigit() and int(data[1]) >= 1
                 elif data[0]==cmd.CMD_POWER:
                     try:
                         if len(data)==3:
@@ -642,8 +658,9 @@ class MyWindow(QMainWindow,Ui_client):
             self.Button_Sonic.setText('Sonic')
             #
     def getSonicData(self):
-        command=cmd.CMD_SONIC+'\n'
-        self.client.send_data(command)
+        if not self.client.telemetry:
+            command=cmd.CMD_SONIC+'\n'
+            self.client.send_data(command)
         #print (command)
 
     def showCalibrationWindow(self):
@@ -673,11 +690,12 @@ class MyWindow(QMainWindow,Ui_client):
             print(e)
 
     def refresh_image(self):
-        if self.client.video_flag == False:
-            height, width, bytesPerComponent=self.client.image.shape
-            #print (height, width, bytesPerComponent)
-            cv2.cvtColor(self.client.image, cv2.COLOR_BGR2RGB, self.client.image)
-            QImg = QImage(self.client.image.data.tobytes(), width, height, 3 * width, QImage.Format_RGB888)
+        #Show the newest decoded frame; it is already converted to RGB on a decoder thread
+        frame=self.client.frame_slot.take()
+        if frame is not None:
+            image=frame[1]
+            height, width=image.shape[:2]
+            QImg = QImage(image.data, width, height, 3 * width, QImage.Format_RGB888)
             self.Video.setPixmap(QPixmap.fromImage(QImg))
             self.client.video_flag = True
 
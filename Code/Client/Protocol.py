@@ -0,0 +1,33 @@
+# -*- coding: utf-8 -*-
+import struct
+from Command import COMMAND as cmd
+
+# Binary framing for the port 5002 command channel, matching Server/protocol.py.
+# Frames are MAGIC, opcode, payload length, then a fixed little-endian payload.
+PROTOCOL_VERSION = 1
+MAGIC = 0xA5
+HEADER = struct.Struct('<BBB')
+BINARY_OPCODES = {
+    cmd.CMD_MOVE: (0x01, struct.Struct('<bbbbb')),      # gait, x, y, speed, angle
+    cmd.CMD_ATTITUDE: (0x02, struct.Struct('<bbb')),    # roll, pitch, yaw
+    cmd.CMD_POSITION: (0x03, struct.Struct('<bbb')),    # x, y, z
+    cmd.CMD_HEAD: (0x04, struct.Struct('<Bh')),         # servo channel, angle
+}
+
+def encode_text(data):
+    """Encode text protocol lines, using binary frames for commands that have an opcode."""
+    encoded = bytearray()
+    for line in data.split('\n'):
+        if line == '':
+            continue
+        parts = line.split('#')
+        if parts[0] in BINARY_OPCODES:
+            opcode, layout = BINARY_OPCODES[parts[0]]
+            try:
+                payload = layout.pack(*[int(part) for part in parts[1:]])
+                encoded += HEADER.pack(MAGIC, opcode, layout.size) + payload
+                continue
+            except (ValueError, struct.error):
+                pass
+        encoded += (line + '\n').encode('utf-8')
+    return bytes(encoded)
@@ -0,0 +1,78 @@
+# -*- coding: utf-8 -*-
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+def is_valid_jpeg(buf):
+    """Cheap completeness check: SOI marker at the start and EOI marker at the end, ignoring padding."""
+    end=len(buf)
+    while end>4 and buf[end-1] in (0,10,13):
+        end-=1
+    return end>4 and buf[0]==0xFF and buf[1]==0xD8 and buf[end-2]==0xFF and buf[end-1]==0xD9
+
+class FrameSlot:
+    """Holds only the newest decoded frame. Older frames are overwritten, never queued."""
+    def __init__(self):
+        self.lock=threading.Lock()
+        self.frame=None
+        self.sequence=-1
+        self.fresh=False
+    def put(self,sequence,frame):
+        """Store a frame unless a newer one is already there. Returns True if it was stored."""
+        with self.lock:
+            if sequence<=self.sequence:
+                return False
+            self.sequence=sequence
+            self.frame=frame
+            self.fresh=True
+            return True
+    def take(self):
+        """Return the newest frame if it has not been taken yet, otherwise None."""
+        with self.lock:
+            if not self.fresh:
+                return None
+            self.fresh=False
+            return self.frame
+
+class DecoderPool:
+    """
+    Runs decode(sequence, data) on worker threads so the socket reader never waits for it.
+    With drop_stale, at most one encoded frame waits for a free worker and a newer one replaces it.
+    Without it (inter-coded video), frames are decoded in order by a single worker and the reader
+    blocks once max_pending frames are waiting.
+    """
+    def __init__(self,decode,workers=2,drop_stale=True,max_pending=30):
+        self.decode=decode
+        self.drop_stale=drop_stale
+        self.workers=workers if drop_stale else 1
+        self.max_pending=1 if drop_stale else max_pending
+        self.executor=ThreadPoolExecutor(max_workers=self.workers)
+        self.condition=threading.Condition()
+        self.pending=deque()
+        self.busy=0
+        self.dropped=0
+    def submit(self,sequence,data):
+        with self.condition:
+            if self.busy<self.workers:
+                self.busy+=1
+                self.executor.submit(self.run,sequence,data)
+                return
+            if self.drop_stale:
+                if self.pending:
+                    self.pending.popleft()
+                    self.dropped+=1
+            else:
+                self.condition.wait_for(lambda:len(self.pending)<self.max_pending)
+            self.pending.append((sequence,data))
+    def run(self,sequence,data):
+        while True:
+            try:
+                self.decode(sequence,data)
+            except Exception as e:
+                print(e)
+            with self.condition:
+                if not self.pending:
+                    self.busy-=1
+                    return
+                sequence,data=self.pending.popleft()
+                self.condition.notify_all()
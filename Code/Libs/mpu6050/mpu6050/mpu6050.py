@@ -9,6 +9,7 @@ https://github.com/m-rtijn/mpu6050
 """
 
 import smbus
+import struct
 
 class mpu6050:
 
@@ -39,6 +40,12 @@ class mpu6050:
     GYRO_RANGE_1000DEG = 0x10
     GYRO_RANGE_2000DEG = 0x18
 
+    # Range register value -> scale modifier
+    ACCEL_SCALE_MODIFIERS = {ACCEL_RANGE_2G: ACCEL_SCALE_MODIFIER_2G, ACCEL_RANGE_4G: ACCEL_SCALE_MODIFIER_4G,
+                             ACCEL_RANGE_8G: ACCEL_SCALE_MODIFIER_8G, ACCEL_RANGE_16G: ACCEL_SCALE_MODIFIER_16G}
+    GYRO_SCALE_MODIFIERS = {GYRO_RANGE_250DEG: GYRO_SCALE_MODIFIER_250DEG, GYRO_RANGE_500DEG: GYRO_SCALE_MODIFIER_500DEG,
+                            GYRO_RANGE_1000DEG: GYRO_SCALE_MODIFIER_1000DEG, GYRO_RANGE_2000DEG: GYRO_SCALE_MODIFIER_2000DEG}
+
     FILTER_BW_256=0x00
     FILTER_BW_188=0x01
     FILTER_BW_98=0x02
@@ -65,11 +72,50 @@ class mpu6050:
     GYRO_CONFIG = 0x1B
     MPU_CONFIG = 0x1A
 
+    SMPLRT_DIV = 0x19
+    FIFO_EN = 0x23
+    INT_STATUS = 0x3A
+    USER_CTRL = 0x6A
+    FIFO_COUNTH = 0x72
+    FIFO_R_W = 0x74
+
+    # FIFO_EN bits: gyro X, Y, Z and accelerometer, 12 bytes per sample
+    FIFO_EN_GYRO_ACCEL = 0x78
+    FIFO_SAMPLE_SIZE = 12
+    FIFO_SIZE = 1024
+    USER_CTRL_FIFO_EN = 0x40
+    USER_CTRL_FIFO_RESET = 0x04
+    INT_STATUS_FIFO_OFLOW = 0x10
+    I2C_BLOCK_MAX = 32
+
     def __init__(self, address, bus=1):
         self.address = address
         self.bus = smbus.SMBus(bus)
         # Wake up the MPU-6050 since it starts in sleep mode
         self.bus.write_byte_data(self.address, self.PWR_MGMT_1, 0x00)
+        # Remember the configured ranges so samples can be scaled without asking the chip
+        self._cache_accel_range(self.read_accel_range(True))
+        self._cache_gyro_range(self.read_gyro_range(True))
+        self.fifo_enabled = False
+        self.fifo_rate = None
+        self.fifo_overflows = 0
+
+    def _cache_accel_range(self, accel_range):
+        self.accel_range = accel_range
+        modifier = self.ACCEL_SCALE_MODIFIERS.get(accel_range)
+        if modifier is None:
+            print("Unkown range - accel_scale_modifier set to self.ACCEL_SCALE_MODIFIER_2G")
+            modifier = self.ACCEL_SCALE_MODIFIER_2G
+        self.accel_scale_g = 1.0 / modifier
+        self.accel_scale_ms2 = self.GRAVITIY_MS2 / modifier
+
+    def _cache_gyro_range(self, gyro_range):
+        self.gyro_range = gyro_range
+        modifier = self.GYRO_SCALE_MODIFIERS.get(gyro_range)
+        if modifier is None:
+            print("Unkown range - gyro_scale_modifier set to self.GYRO_SCALE_MODIFIER_250DEG")
+            modifier = self.GYRO_SCALE_MODIFIER_250DEG
+        self.gyro_scale = 1.0 / modifier
 
     # I2C communication methods
 
@@ -90,6 +136,14 @@ class mpu6050:
         else:
             return value
 
+    def read_i2c_block(self, register, length):
+        """Read length consecutive registers in one I2C transaction.
+
+        register -- the first register to read from.
+        Returns the raw bytes.
+        """
+        return bytes(self.bus.read_i2c_block_data(self.address, register, length))
+
     # MPU-6050 Methods
 
     def get_temp(self):
@@ -116,6 +170,7 @@ class mpu6050:
 
         # Write the new range to the ACCEL_CONFIG register
         self.bus.write_byte_data(self.address, self.ACCEL_CONFIG, accel_range)
+        self._cache_accel_range(accel_range)
 
     def read_accel_range(self, raw = False):
         """Reads the range the accelerometer is set to.
@@ -148,36 +203,8 @@ class mpu6050:
         If g is False, it will return the data in m/s^2
         Returns a dictionary with the measurement results.
         """
-        x = self.read_i2c_word(self.ACCEL_XOUT0)
-        y = self.read_i2c_word(self.ACCEL_YOUT0)
-        z = self.read_i2c_word(self.ACCEL_ZOUT0)
-
-        accel_scale_modifier = None
-        accel_range = self.read_accel_range(True)
-
-        if accel_range == self.ACCEL_RANGE_2G:
-            accel_scale_modifier = self.ACCEL_SCALE_MODIFIER_2G
-        elif accel_range == self.ACCEL_RANGE_4G:
-            accel_scale_modifier = self.ACCEL_SCALE_MODIFIER_4G
-        elif accel_range == self.ACCEL_RANGE_8G:
-            accel_scale_modifier = self.ACCEL_SCALE_MODIFIER_8G
-        elif accel_range == self.ACCEL_RANGE_16G:
-            accel_scale_modifier = self.ACCEL_SCALE_MODIFIER_16G
-        else:
-            print("Unkown range - accel_scale_modifier set to self.ACCEL_SCALE_MODIFIER_2G")
-            accel_scale_modifier = self.ACCEL_SCALE_MODIFIER_2G
-
-        x = x / accel_scale_modifier
-        y = y / accel_scale_modifier
-        z = z / accel_scale_modifier
-
-        if g is True:
-            return {'x': x, 'y': y, 'z': z}
-        elif g is False:
-            x = x * self.GRAVITIY_MS2
-            y = y * self.GRAVITIY_MS2
-            z = z * self.GRAVITIY_MS2
-            return {'x': x, 'y': y, 'z': z}
+        x, y, z = self.get_accel(g)
+        return {'x': x, 'y': y, 'z': z}
 
     def set_gyro_range(self, gyro_range):
         """Sets the range of the gyroscope to range.
@@ -190,6 +217,7 @@ class mpu6050:
 
         # Write the new range to the ACCEL_CONFIG register
         self.bus.write_byte_data(self.address, self.GYRO_CONFIG, gyro_range)
+        self._cache_gyro_range(gyro_range)
 
     def set_filter_range(self, filter_range=FILTER_BW_256):
         """Sets the low-pass bandpass filter frequency"""
@@ -227,29 +255,7 @@ class mpu6050:
 
         Returns the read values in a dictionary.
         """
-        x = self.read_i2c_word(self.GYRO_XOUT0)
-        y = self.read_i2c_word(self.GYRO_YOUT0)
-        z = self.read_i2c_word(self.GYRO_ZOUT0)
-
-        gyro_scale_modifier = None
-        gyro_range = self.read_gyro_range(True)
-
-        if gyro_range == self.GYRO_RANGE_250DEG:
-            gyro_scale_modifier = self.GYRO_SCALE_MODIFIER_250DEG
-        elif gyro_range == self.GYRO_RANGE_500DEG:
-            gyro_scale_modifier = self.GYRO_SCALE_MODIFIER_500DEG
-        elif gyro_range == self.GYRO_RANGE_1000DEG:
-            gyro_scale_modifier = self.GYRO_SCALE_MODIFIER_1000DEG
-        elif gyro_range == self.GYRO_RANGE_2000DEG:
-            gyro_scale_modifier = self.GYRO_SCALE_MODIFIER_2000DEG
-        else:
-            print("Unkown range - gyro_scale_modifier set to self.GYRO_SCALE_MODIFIER_250DEG")
-            gyro_scale_modifier = self.GYRO_SCALE_MODIFIER_250DEG
-
-        x = x / gyro_scale_modifier
-        y = y / gyro_scale_modifier
-        z = z / gyro_scale_modifier
-
+        x, y, z = self.get_gyro()
         return {'x': x, 'y': y, 'z': z}
 
     def get_all_data(self):
@@ -260,6 +266,108 @@ class mpu6050:
 
         return [accel, gyro, temp]
 
+    # Fast read API: tuples, one block read each, scaled with the cached ranges
+
+    def get_accel(self, g = False):
+        """Returns the accelerometer (x, y, z) in m/s^2, or in g if g is True."""
+        scale = self.accel_scale_g if g else self.accel_scale_ms2
+        x, y, z = struct.unpack('>3h', self.read_i2c_block(self.ACCEL_XOUT0, 6))
+        return (x * scale, y * scale, z * scale)
+
+    def get_gyro(self):
+        """Returns the gyroscope (x, y, z) in degrees per second."""
+        scale = self.gyro_scale
+        x, y, z = struct.unpack('>3h', self.read_i2c_block(self.GYRO_XOUT0, 6))
+        return (x * scale, y * scale, z * scale)
+
+    def get_motion(self, g = False):
+        """Returns (ax, ay, az, gx, gy, gz, temp) from one 14 byte burst.
+
+        Acceleration is in m/s^2 (g if g is True), rotation in degrees per
+        second and temperature in degrees Celcius.
+        """
+        ax, ay, az, raw_temp, gx, gy, gz = struct.unpack('>7h', self.read_i2c_block(self.ACCEL_XOUT0, 14))
+        accel_scale = self.accel_scale_g if g else self.accel_scale_ms2
+        gyro_scale = self.gyro_scale
+        return (ax * accel_scale, ay * accel_scale, az * accel_scale,
+                gx * gyro_scale, gy * gyro_scale, gz * gyro_scale,
+                (raw_temp / 340.0) + 36.53)
+
+    def get_all_data_burst(self, g = False):
+        """Reads the accelerometer, temperature and gyroscope in one burst.
+
+        ACCEL_XOUT0 to GYRO_ZOUT0 are 14 consecutive registers, so a single
+        block read replaces the byte-by-byte reads and all values come from
+        the same sample. Returns [accel, gyro, temp] like get_all_data().
+        """
+        ax, ay, az, gx, gy, gz, temp = self.get_motion(g)
+        accel = {'x': ax, 'y': ay, 'z': az}
+        gyro = {'x': gx, 'y': gy, 'z': gz}
+        return [accel, gyro, temp]
+
+    # Hardware FIFO
+
+    def enable_fifo(self, sample_rate = 200):
+        """Starts buffering accelerometer and gyroscope samples in the FIFO.
+
+        sample_rate -- samples per second, set through the SMPLRT_DIV divider.
+        Returns the sample rate the chip actually uses.
+        """
+        # The gyro output rate is 8 kHz with the low pass filter off and 1 kHz with it on
+        dlpf = self.bus.read_byte_data(self.address, self.MPU_CONFIG) & 0x07
+        output_rate = 8000.0 if dlpf in (0, 7) else 1000.0
+        divider = min(255, max(0, int(round(output_rate / sample_rate)) - 1))
+        self.bus.write_byte_data(self.address, self.SMPLRT_DIV, divider)
+        self.bus.write_byte_data(self.address, self.FIFO_EN, self.FIFO_EN_GYRO_ACCEL)
+        self.reset_fifo()
+        self.fifo_enabled = True
+        self.fifo_rate = output_rate / (divider + 1)
+        return self.fifo_rate
+
+    def disable_fifo(self):
+        """Stops buffering samples in the FIFO."""
+        self.bus.write_byte_data(self.address, self.USER_CTRL, 0x00)
+        self.bus.write_byte_data(self.address, self.FIFO_EN, 0x00)
+        self.fifo_enabled = False
+
+    def reset_fifo(self):
+        """Empties the FIFO and keeps it running."""
+        self.bus.write_byte_data(self.address, self.USER_CTRL, self.USER_CTRL_FIFO_RESET)
+        self.bus.write_byte_data(self.address, self.USER_CTRL, self.USER_CTRL_FIFO_EN)
+
+    def get_fifo_count(self):
+        """Returns the number of bytes waiting in the FIFO."""
+        return struct.unpack('>H', self.read_i2c_block(self.FIFO_COUNTH, 2))[0]
+
+    def read_fifo(self, g = False):
+        """Reads every complete sample waiting in the FIFO.
+
+        Returns a list of (ax, ay, az, gx, gy, gz) tuples, oldest first, in
+        the units of get_motion(). If the FIFO overflowed its contents are
+        no longer aligned to samples, so it is reset, fifo_overflows is
+        incremented and an empty list is returned.
+        """
+        status = self.bus.read_byte_data(self.address, self.INT_STATUS)
+        count = self.get_fifo_count()
+        if status & self.INT_STATUS_FIFO_OFLOW or count >= self.FIFO_SIZE:
+            self.fifo_overflows += 1
+            self.reset_fifo()
+            return []
+        count -= count % self.FIFO_SAMPLE_SIZE
+        # Whole samples per block read, within the SMBus block limit
+        chunk = self.I2C_BLOCK_MAX - self.I2C_BLOCK_MAX % self.FIFO_SAMPLE_SIZE
+        data = bytearray()
+        while len(data) < count:
+            data += self.read_i2c_block(self.FIFO_R_W, min(chunk, count - len(data)))
+
+        accel_scale = self.accel_scale_g if g else self.accel_scale_ms2
+        gyro_scale = self.gyro_scale
+        samples = []
+        for ax, ay, az, gx, gy, gz in struct.iter_unpack('>6h', data):
+            samples.append((ax * accel_scale, ay * accel_scale, az * accel_scale,
+                            gx * gyro_scale, gy * gyro_scale, gz * gyro_scale))
+        return samples
+
 if __name__ == "__main__":
     mpu = mpu6050(0x68)
     print(mpu.get_temp())
@@ -0,0 +1,164 @@
+# -*- coding: utf-8 -*-
+"""
+Single asyncio event loop serving the command (5002), video (8002) and REST (8000) ports.
+
+Sockets and clients are handled as coroutines instead of one thread per
+accept/recv loop. Blocking hardware calls run on Server.hardware_executor,
+and one dedicated thread wakes the viewers whenever the camera publishes
+a frame into its shared ring buffer.
+"""
+import asyncio
+import struct
+import time
+from concurrent.futures import ThreadPoolExecutor
+import uvicorn
+from command import COMMAND as cmd
+from protocol import StreamReassembler
+from telemetry import telemetry_message
+from frame_buffer import FrameCursor
+from video_quality import unsent_bytes
+from rest_api import app, set_server
+
+class AsyncServer:
+    # Telemetry is dropped for a client while this much is still waiting in its send buffer
+    TELEMETRY_BUFFER_LIMIT = 64 * 1024
+
+    def __init__(self, server, command_port: int = 5002, video_port: int = 8002, api_port: int = 8000):
+        self.server = server
+        self.command_port = command_port
+        self.video_port = video_port
+        self.api_port = api_port
+        self.command_clients = set()
+        self.video_clients = 0
+        self.telemetry_dropped = 0
+        self.frame_condition = None
+        self.camera_task = None
+        # Waiting for the next encoder frame blocks, so it gets its own thread
+        self.camera_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='camera')
+
+    async def serve(self) -> None:
+        """Run all three servers until cancelled."""
+        self.frame_condition = asyncio.Condition()
+        host_ip = self.server.get_interface_ip()
+        set_server(self.server)
+        command_server = await asyncio.start_server(self.handle_command_client, host_ip, self.command_port, reuse_port=True)
+        video_server = await asyncio.start_server(self.handle_video_client, host_ip, self.video_port, reuse_port=True)
+        api_server = uvicorn.Server(uvicorn.Config(app, host="0.0.0.0", port=self.api_port, log_level="info"))
+        self.server.is_tcp_active = True
+        self.server.tcp_flag = True
+        print('Server address: ' + host_ip)
+        try:
+            async with command_server, video_server:
+                await asyncio.gather(command_server.serve_forever(), video_server.serve_forever(), api_server.serve())
+        finally:
+            self.server.is_tcp_active = False
+            self.server.tcp_flag = False
+            self.camera_executor.shutdown(wait=False)
+
+    async def handle_command_client(self, reader, writer) -> None:
+        """Read commands from one client and dispatch them off the event loop."""
+        loop = asyncio.get_running_loop()
+        reassembler = StreamReassembler()
+        subscription = None
+        self.command_clients.add(writer)
+        print("Client connection successful !", writer.get_extra_info('peername'))
+        try:
+            while True:
+                data = await reader.read(1024)
+                if not data:
+                    break
+                for command in reassembler.feed(data):
+                    if command.name == cmd.CMD_TELEMETRY:
+                        # Subscriptions belong to this connection, not to the shared Server
+                        if subscription is not None:
+                            self.server.telemetry.unsubscribe(subscription)
+                            subscription = None
+                        if command.args[0] == 1:
+                            subscription = self.server.telemetry.subscribe(
+                                lambda name, value, timestamp: loop.call_soon_threadsafe(
+                                    self.push_telemetry, writer, telemetry_message(name, value).encode('utf-8')))
+                        writer.write((cmd.CMD_TELEMETRY + "#" + str(1 if subscription is not None else 0) + "\n").encode('utf-8'))
+                        continue
+                    response = await loop.run_in_executor(self.server.hardware_executor, self.server.dispatch_command, command)
+                    if response:
+                        writer.write(response.encode('utf-8'))
+                        await writer.drain()
+        except (ConnectionError, OSError) as e:
+            print(e)
+        finally:
+            if subscription is not None:
+                self.server.telemetry.unsubscribe(subscription)
+            self.command_clients.discard(writer)
+            writer.close()
+            print("close_recv")
+
+    def push_telemetry(self, writer, message: bytes) -> None:
+        """Queue one telemetry line on the event loop, dropping it if the client is not reading fast enough."""
+        if writer.is_closing() or writer.transport.get_write_buffer_size() > self.TELEMETRY_BUFFER_LIMIT:
+            # Newer samples follow, so a slow client just sees fewer updates instead of an unbounded backlog
+            self.telemetry_dropped += 1
+            return
+        writer.write(message)
+
+    async def handle_video_client(self, reader, writer) -> None:
+        """Send length-prefixed JPEG frames to one viewer, skipping to the newest frame when it falls behind."""
+        loop = asyncio.get_running_loop()
+        camera = self.server.camera_device
+        cursor = await loop.run_in_executor(self.server.hardware_executor, camera.open_viewer)
+        self.video_clients += 1
+        if self.camera_task is None:
+            self.camera_task = asyncio.create_task(self.pump_camera())
+        print("Video socket connected ... ", writer.get_extra_info('peername'))
+        try:
+            while True:
+                async with self.frame_condition:
+                    frame = cursor.poll()
+                    if frame is None:
+                        await self.frame_condition.wait()
+                        continue
+                try:
+                    await self.send_video_frame(writer, cursor, frame)
+                finally:
+                    frame.release()
+        except (ConnectionError, OSError):
+            pass
+        finally:
+            writer.close()
+            self.video_clients -= 1
+            if self.video_clients == 0 and self.camera_task is not None:
+                self.camera_task.cancel()
+                self.camera_task = None
+            camera.close_viewer(cursor)
+            print("End transmit ... ")
+
+    async def send_video_frame(self, writer, cursor, frame) -> None:
+        """Send one frame unless the previous one is still queued, and adapt the stream to the backlog."""
+        quality = self.server.video_quality
+        queued = writer.transport.get_write_buffer_size() + unsent_bytes(writer.get_extra_info('socket'))
+        if quality.should_send(queued, len(frame)):
+            start = time.monotonic()
+            # writelines() hands both buffers to the transport, which uses sendmsg() where supported
+            writer.writelines((struct.pack('<I', len(frame)), frame.data))
+            await writer.drain()
+            change = quality.report(queued, len(frame), time.monotonic() - start)
+        else:
+            cursor.need_keyframe = True   # Resume only at a keyframe, also when the keyframe itself was dropped
+            change = quality.report(queued, len(frame), 0.0, sent=False)
+        if change is not None:
+            loop = asyncio.get_running_loop()
+            await loop.run_in_executor(self.server.hardware_executor, self.server.camera_device.set_stream_quality, *change)
+
+    async def pump_camera(self) -> None:
+        """Wake the viewers each time the camera publishes a frame into the shared ring."""
+        loop = asyncio.get_running_loop()
+        cursor = FrameCursor(self.server.camera_device.streaming_output.frames, max_lag=0)
+        while True:
+            frame = await loop.run_in_executor(self.camera_executor, cursor.next_frame, 1.0)
+            if frame is not None:
+                frame.release()
+                async with self.frame_condition:
+                    self.frame_condition.notify_all()
+
+if __name__ == '__main__':
+    from server import Server
+    asyncio.run(AsyncServer(Server()).serve())
@@ -3,20 +3,45 @@ from picamera2 import Picamera2, Preview
 from picamera2.encoders import H264Encoder, JpegEncoder
 from picamera2.outputs import FileOutput
 from libcamera import Transform
-from threading import Condition
+from threading import Lock
+from frame_buffer import Frame, FrameRingBuffer, FrameCursor
 import io
 
+STREAM_MJPEG = 0  # One JPEG per frame, every frame decodable on its own
+STREAM_H264 = 1   # One H.264 access unit (Annex-B NAL units) per frame
+DEFAULT_JPEG_QUALITY = 85
+
+def is_h264_keyframe(buf) -> bool:
+    """Return True if an H.264 access unit starts with SPS/PPS or an IDR slice."""
+    head = bytes(buf[:64])
+    start = head.find(b'\x00\x00\x01')
+    while 0 <= start < len(head) - 3:
+        nal_type = head[start + 3] & 0x1F
+        if nal_type in (5, 7, 8):      # IDR slice, SPS, PPS
+            return True
+        if nal_type == 1:              # Non-IDR slice
+            return False
+        start = head.find(b'\x00\x00\x01', start + 3)
+    return False
+
 class StreamingOutput(io.BufferedIOBase):
-    def __init__(self):
+    def __init__(self, buffer_size: int = 8):
         """Initialize the StreamingOutput class."""
-        self.frame = None
-        self.condition = Condition()  # Initialize the condition variable for thread synchronization
+        self.frames = FrameRingBuffer(buffer_size)  # Last encoded frames, shared by all viewers
+        self.condition = self.frames.condition      # Notified whenever a new frame is published
+        self.h264 = False                           # Set while an H.264 encoder feeds this output
+
+    @property
+    def frame(self) -> Frame:
+        """The newest encoded Frame, or None. The caller owns a reference and must release() it."""
+        return self.frames.latest()[1]
 
     def write(self, buf: bytes) -> int:
-        """Write a buffer to the frame and notify all waiting threads."""
-        with self.condition:
-            self.frame = buf             # Update the frame buffer with new data
-            self.condition.notify_all()  # Notify all waiting threads that new data is available
+        """Publish a buffer to the frame ring and notify all waiting threads."""
+        if not isinstance(buf, bytes):
+            buf = bytes(buf)                        # Encoder-owned memory is reused after write() returns
+        keyframe = is_h264_keyframe(buf) if self.h264 else True
+        self.frames.publish(Frame(buf, keyframe=keyframe))  # Wrapped, not copied
         return len(buf)
 
 class Camera:
@@ -34,9 +59,22 @@ class Camera:
         
         # Configure video stream
         self.stream_size = stream_size  # Set the size of the video stream
-        self.stream_config = self.camera.create_video_configuration(main={"size": stream_size}, transform=self.transform)  # Create the video configuration
+        self.jpeg_quality = DEFAULT_JPEG_QUALITY  # JPEG quality, also scales the H.264 bitrate
+        self.frame_rate = 30                      # Stream frame rate
+        self.stream_config = self.create_stream_config()  # Create the video configuration
+        self.stream_format = STREAM_MJPEG  # Network stream encoding
+        self.bitrate = 1000000             # H.264 target bitrate in bits per second
+        self.keyframe_interval = 30        # H.264 frames between keyframes
         self.streaming_output = StreamingOutput()  # Initialize the streaming output object
         self.streaming = False  # Initialize the streaming flag
+        self.viewers = 0        # Number of open viewer cursors
+        self.viewer_lock = Lock()
+
+    def create_stream_config(self) -> dict:
+        """Create the video configuration for the current stream size and frame rate."""
+        frame_duration = int(1000000 / self.frame_rate)
+        return self.camera.create_video_configuration(main={"size": self.stream_size}, transform=self.transform,
+                                                      controls={"FrameDurationLimits": (frame_duration, frame_duration)})
 
     def start_image(self) -> None:
         """Start the camera preview and capture."""
@@ -62,9 +100,15 @@ class Camera:
             if filename:
                 encoder = H264Encoder()                    # Use H264 encoder for video recording
                 output = FileOutput(filename)              # Set the output file for the recorded video
+            elif self.stream_format == STREAM_H264:
+                # repeat=True resends SPS/PPS with every keyframe so viewers can join mid-stream
+                bitrate = int(self.bitrate * self.jpeg_quality / DEFAULT_JPEG_QUALITY)
+                encoder = H264Encoder(bitrate=bitrate, repeat=True, iperiod=self.keyframe_interval)
+                output = FileOutput(self.streaming_output) # Each write() is one access unit
             else:
-                encoder = JpegEncoder()                    # Use Jpeg encoder for streaming
+                encoder = JpegEncoder(q=self.jpeg_quality) # Use Jpeg encoder for streaming
                 output = FileOutput(self.streaming_output) # Set the streaming output object
+            self.streaming_output.h264 = not filename and self.stream_format == STREAM_H264
             self.camera.start_recording(encoder, output)   # Start recording or streaming
             self.streaming = True                          # Set the streaming flag to True
 
@@ -77,8 +121,52 @@ class Camera:
             except Exception as e:
                 print(f"Error stopping stream: {e}")       # Print error message if stopping fails
 
-    def get_frame(self) -> bytes:
-        """Get the current frame from the streaming output."""
+    def set_stream_format(self, stream_format: int, bitrate: int = None, keyframe_interval: int = None) -> None:
+        """Select MJPEG or H.264 streaming, restarting the encoder if viewers are connected."""
+        with self.viewer_lock:
+            self.stream_format = STREAM_H264 if stream_format == STREAM_H264 else STREAM_MJPEG
+            if bitrate is not None:
+                self.bitrate = max(100000, bitrate)                 # Clamp to a usable minimum
+            if keyframe_interval is not None:
+                self.keyframe_interval = max(1, keyframe_interval)
+            if self.streaming:
+                self.stop_stream()                         # The encoder is shared by all viewers
+                self.start_stream()
+
+    def set_stream_quality(self, quality: int, stream_size: tuple, frame_rate: int) -> None:
+        """Change JPEG quality, stream size and frame rate; only quality and size restart the encoder."""
+        with self.viewer_lock:
+            restart = quality != self.jpeg_quality or tuple(stream_size) != tuple(self.stream_size)
+            self.jpeg_quality = quality
+            self.stream_size = tuple(stream_size)
+            self.frame_rate = frame_rate
+            self.stream_config = self.create_stream_config()
+            if not self.streaming:
+                return
+            if restart:
+                self.stop_stream()
+                self.start_stream()
+            else:
+                frame_duration = int(1000000 / frame_rate)
+                self.camera.set_controls({"FrameDurationLimits": (frame_duration, frame_duration)})
+
+    def open_viewer(self, max_lag: int = 0) -> FrameCursor:
+        """Start streaming if needed and return a new cursor into the shared frame ring."""
+        with self.viewer_lock:
+            self.viewers += 1
+            if self.viewers == 1:
+                self.start_stream()                        # The first viewer starts the encoder
+            return FrameCursor(self.streaming_output.frames, max_lag)
+
+    def close_viewer(self, cursor: FrameCursor) -> None:
+        """Release a viewer cursor and stop streaming when it was the last one."""
+        with self.viewer_lock:
+            self.viewers = max(0, self.viewers - 1)
+            if self.viewers == 0:
+                self.stop_stream()                         # No one is watching any more
+
+    def get_frame(self) -> Frame:
+        """Wait for the next frame and return it; the caller must release() it when done."""
         with self.streaming_output.condition:
             self.streaming_output.condition.wait()         # Wait for a new frame to be available
             return self.streaming_output.frame             # Return the current frame
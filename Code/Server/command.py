@@ -1,3 +1,5 @@
+import time
+
 class COMMAND:
     CMD_MOVE = "CMD_MOVE"
     CMD_LED_MOD = "CMD_LED_MOD"
@@ -13,6 +15,66 @@ class COMMAND:
     CMD_CALIBRATION = "CMD_CALIBRATION"
     CMD_CAMERA = "CMD_CAMERA"
     CMD_SERVOPOWER = "CMD_SERVOPOWER"
-    
+    CMD_PROTOCOL = "CMD_PROTOCOL"
+    CMD_VIDEO = "CMD_VIDEO"
+    CMD_TELEMETRY = "CMD_TELEMETRY"
+    CMD_IMU = "CMD_IMU"
+
     def __init__(self):
         pass
+
+# Accepted argument signatures for each command, as tuples of converters
+COMMAND_ARGS = {
+    COMMAND.CMD_MOVE: [(int, int, int, int, int)],          # gait, x, y, speed, angle
+    COMMAND.CMD_LED_MOD: [(int,)],                          # mode
+    COMMAND.CMD_LED: [(int, int, int)],                     # r, g, b
+    COMMAND.CMD_SONIC: [()],
+    COMMAND.CMD_BUZZER: [(int,)],                           # 1=on, 0=off
+    COMMAND.CMD_HEAD: [(int, int)],                         # servo channel, angle
+    COMMAND.CMD_BALANCE: [(int,)],                          # 1=enable, 0=disable
+    COMMAND.CMD_ATTITUDE: [(int, int, int)],                # roll, pitch, yaw
+    COMMAND.CMD_POSITION: [(int, int, int)],                # x, y, z
+    COMMAND.CMD_RELAX: [()],
+    COMMAND.CMD_POWER: [()],
+    COMMAND.CMD_CALIBRATION: [(), (str,), (str, int, int, int)],  # [leg or "save"[, x, y, z]]
+    COMMAND.CMD_CAMERA: [(int, int)],                       # x, y
+    COMMAND.CMD_SERVOPOWER: [(int,)],                       # 1=on, 0=off
+    COMMAND.CMD_PROTOCOL: [(int,)],                         # requested protocol version
+    COMMAND.CMD_VIDEO: [(int,), (int, int, int)],           # 0=MJPEG, 1=H.264[, bitrate kbps, keyframe interval]
+    COMMAND.CMD_TELEMETRY: [(int,)],                        # 1=subscribe, 0=unsubscribe
+}
+
+class Command:
+    """A command parsed once at the network edge into its name and typed arguments."""
+    __slots__ = ('name', 'args', 'received_at')
+
+    def __init__(self, name: str, args: tuple = (), received_at: float = None):
+        self.name = name
+        self.args = tuple(args)
+        # Monotonic arrival time, used to measure command-to-servo latency
+        self.received_at = time.monotonic() if received_at is None else received_at
+
+    @classmethod
+    def from_parts(cls, parts: list):
+        """Build a Command from '#'-split string parts, or return None if they are invalid."""
+        if not parts or parts[0] not in COMMAND_ARGS:
+            return None
+        values = parts[1:]
+        for signature in COMMAND_ARGS[parts[0]]:
+            if len(signature) == len(values):
+                try:
+                    return cls(parts[0], [convert(value) for convert, value in zip(signature, values)])
+                except ValueError:
+                    return None
+        return None
+
+    def to_parts(self) -> list:
+        """Return the command as the '#'-split string list used by the text protocol."""
+        return [self.name] + [str(arg) for arg in self.args]
+
+    def __repr__(self):
+        return f"Command({self.name!r}, {self.args!r})"
+
+def parse_command(text: str):
+    """Parse one line of the text protocol, e.g. 'CMD_MOVE#1#0#25#10#0'."""
+    return Command.from_parts(text.strip().split('#'))
@@ -10,8 +10,16 @@ from pid import Incremental_PID
 from command import COMMAND as cmd
 from imu import IMU
 from servo import Servo
+import kinematics
+from gait_cache import GaitCache, GaitCycle
+from scheduler import LoopScheduler
 
 class Control:
+    # Servo channels (coxa, femur, tibia) for legs 1-6
+    LEG_SERVO_CHANNELS = [[15, 14, 13], [12, 11, 10], [9, 8, 31], [22, 23, 27], [19, 20, 21], [16, 17, 18]]
+    # Leg names used by CMD_CALIBRATION
+    CALIBRATION_LEGS = ["one", "two", "three", "four", "five", "six"]
+
     def __init__(self):
         self.imu = IMU()
         self.servo = Servo()
@@ -29,11 +37,23 @@ class Control:
         self.leg_positions = [[140, 0, 0], [140, 0, 0], [140, 0, 0], [140, 0, 0], [140, 0, 0], [140, 0, 0]]
         self.calibration_angles = [[0, 0, 0], [0, 0, 0], [0, 0, 0], [0, 0, 0], [0, 0, 0], [0, 0, 0]]
         self.current_angles = [[90, 0, 0], [90, 0, 0], [90, 0, 0], [90, 0, 0], [90, 0, 0], [90, 0, 0]]
-        self.command_queue = ['', '', '', '', '', '']
+        self.pending_command = None
+        self.last_command = None
+        self.latency_command = None
+        self.command_latency = None  # Seconds from command arrival to its first servo write
+        self.command_handlers = {
+            cmd.CMD_POSITION: self.handle_position,
+            cmd.CMD_ATTITUDE: self.handle_attitude,
+            cmd.CMD_MOVE: self.handle_move,
+            cmd.CMD_BALANCE: self.handle_balance,
+            cmd.CMD_CALIBRATION: self.handle_calibration,
+        }
+        self.gait_cache = GaitCache()
+        self.gait_scheduler = LoopScheduler(0.01)
         self.calibrate()
         self.set_leg_angles()
+        self.command_condition = threading.Condition()
         self.condition_thread = threading.Thread(target=self.condition_monitor)
-        self.Thread_conditiona = threading.Condition()
 
     def read_from_txt(self, filename):
         with open(filename + ".txt", "r") as file:
@@ -70,152 +90,129 @@ class Control:
 
     def calibrate(self):
         self.leg_positions = [[140, 0, 0], [140, 0, 0], [140, 0, 0], [140, 0, 0], [140, 0, 0], [140, 0, 0]]
-        for i in range(6):
-            self.calibration_angles[i][0], self.calibration_angles[i][1], self.calibration_angles[i][2] = self.coordinate_to_angle(
-                -self.calibration_leg_positions[i][2], self.calibration_leg_positions[i][0], self.calibration_leg_positions[i][1])
-        for i in range(6):
-            self.current_angles[i][0], self.current_angles[i][1], self.current_angles[i][2] = self.coordinate_to_angle(
-                -self.leg_positions[i][2], self.leg_positions[i][0], self.leg_positions[i][1])
-        for i in range(6):
-            self.calibration_angles[i][0] = self.calibration_angles[i][0] - self.current_angles[i][0]
-            self.calibration_angles[i][1] = self.calibration_angles[i][1] - self.current_angles[i][1]
-            self.calibration_angles[i][2] = self.calibration_angles[i][2] - self.current_angles[i][2]
+        calibration_angles = kinematics.coordinate_to_angle(kinematics.to_ik_frame(self.calibration_leg_positions))
+        current_angles = kinematics.coordinate_to_angle(kinematics.to_ik_frame(self.leg_positions))
+        self.calibration_angles = (calibration_angles - current_angles).tolist()
+        self.current_angles = current_angles.tolist()
+        self.gait_cache.clear()
 
     def set_leg_angles(self):
         if self.check_point_validity():
-            for i in range(6):
-                self.current_angles[i][0], self.current_angles[i][1], self.current_angles[i][2] = self.coordinate_to_angle(
-                    -self.leg_positions[i][2], self.leg_positions[i][0], self.leg_positions[i][1])
-            for i in range(3):
-                self.current_angles[i][0] = self.restrict_value(self.current_angles[i][0] + self.calibration_angles[i][0], 0, 180)
-                self.current_angles[i][1] = self.restrict_value(90 - (self.current_angles[i][1] + self.calibration_angles[i][1]), 0, 180)
-                self.current_angles[i][2] = self.restrict_value(self.current_angles[i][2] + self.calibration_angles[i][2], 0, 180)
-                self.current_angles[i + 3][0] = self.restrict_value(self.current_angles[i + 3][0] + self.calibration_angles[i + 3][0], 0, 180)
-                self.current_angles[i + 3][1] = self.restrict_value(90 + self.current_angles[i + 3][1] + self.calibration_angles[i + 3][1], 0, 180)
-                self.current_angles[i + 3][2] = self.restrict_value(180 - (self.current_angles[i + 3][2] + self.calibration_angles[i + 3][2]), 0, 180)
-            # Leg 1
-            self.servo.set_servo_angle(15, self.current_angles[0][0])
-            self.servo.set_servo_angle(14, self.current_angles[0][1])
-            self.servo.set_servo_angle(13, self.current_angles[0][2])
-            # Leg 2
-            self.servo.set_servo_angle(12, self.current_angles[1][0])
-            self.servo.set_servo_angle(11, self.current_angles[1][1])
-            self.servo.set_servo_angle(10, self.current_angles[1][2])
-            # Leg 3
-            self.servo.set_servo_angle(9, self.current_angles[2][0])
-            self.servo.set_servo_angle(8, self.current_angles[2][1])
-            self.servo.set_servo_angle(31, self.current_angles[2][2])
-            # Leg 6
-            self.servo.set_servo_angle(16, self.current_angles[5][0])
-            self.servo.set_servo_angle(17, self.current_angles[5][1])
-            self.servo.set_servo_angle(18, self.current_angles[5][2])
-            # Leg 5
-            self.servo.set_servo_angle(19, self.current_angles[4][0])
-            self.servo.set_servo_angle(20, self.current_angles[4][1])
-            self.servo.set_servo_angle(21, self.current_angles[4][2])
-            # Leg 4
-            self.servo.set_servo_angle(22, self.current_angles[3][0])
-            self.servo.set_servo_angle(23, self.current_angles[3][1])
-            self.servo.set_servo_angle(27, self.current_angles[3][2])
+            self.current_angles = kinematics.leg_positions_to_angles(self.leg_positions, self.calibration_angles).tolist()
+            self.write_servo_angles()
         else:
             print("This coordinate point is out of the active range")
 
+    def write_servo_angles(self):
+        if self.latency_command is not None:
+            self.command_latency = time.monotonic() - self.latency_command.received_at
+            self.latency_command = None
+        angles = {}
+        for leg in range(6):
+            for joint in range(3):
+                angles[self.LEG_SERVO_CHANNELS[leg][joint]] = self.current_angles[leg][joint]
+        self.servo.set_many(angles)
+
     def check_point_validity(self):
-        is_valid = True
-        leg_lengths = [0] * 6
-        for i in range(6):
-            leg_lengths[i] = math.sqrt(self.leg_positions[i][0] ** 2 + self.leg_positions[i][1] ** 2 + self.leg_positions[i][2] ** 2)
-        for length in leg_lengths:
-            if length > 248 or length < 90:
-                is_valid = False
-        return is_valid
+        return kinematics.check_leg_lengths(self.leg_positions)
+
+    def submit_command(self, command):
+        """Hand a parsed Command to the control thread and wake it up."""
+        with self.command_condition:
+            self.pending_command = command
+            self.timeout = time.time()
+            self.command_condition.notify()
+
+    def clear_command(self, command):
+        """Mark command as finished unless a newer one has replaced it meanwhile."""
+        with self.command_condition:
+            if self.pending_command is command:
+                self.pending_command = None
+
+    def wait_for_command(self):
+        """Block until a command is pending or the idle relax timeout is due."""
+        with self.command_condition:
+            while self.pending_command is None:
+                if self.timeout == 0:
+                    self.command_condition.wait()
+                    continue
+                remaining = 10 - (time.time() - self.timeout)
+                if remaining <= 0:
+                    return
+                self.command_condition.wait(remaining)
 
     def condition_monitor(self):
         while True:
-            if (time.time() - self.timeout) > 10 and self.timeout != 0 and self.command_queue[0] == '':
-                self.timeout = time.time()
-                self.relax(True)
-                self.status_flag = 0x00
-            if cmd.CMD_POSITION in self.command_queue and len(self.command_queue) == 4:
-                if self.status_flag != 0x01:
-                    self.relax(False)
-                x = self.restrict_value(int(self.command_queue[1]), -40, 40)
-                y = self.restrict_value(int(self.command_queue[2]), -40, 40)
-                z = self.restrict_value(int(self.command_queue[3]), -20, 20)
-                self.move_position(x, y, z)
-                self.status_flag = 0x01
-                self.command_queue = ['', '', '', '', '', '']
-            elif cmd.CMD_ATTITUDE in self.command_queue and len(self.command_queue) == 4:
-                if self.status_flag != 0x02:
-                    self.relax(False)
-                roll = self.restrict_value(int(self.command_queue[1]), -15, 15)
-                pitch = self.restrict_value(int(self.command_queue[2]), -15, 15)
-                yaw = self.restrict_value(int(self.command_queue[3]), -15, 15)
-                points = self.calculate_posture_balance(roll, pitch, yaw)
-                self.transform_coordinates(points)
-                self.set_leg_angles()
-                self.status_flag = 0x02
-                self.command_queue = ['', '', '', '', '', '']
-            elif cmd.CMD_MOVE in self.command_queue and len(self.command_queue) == 6:
-                if self.command_queue[2] == "0" and self.command_queue[3] == "0":
-                    self.run_gait(self.command_queue)
-                    self.command_queue = ['', '', '', '', '', '']
-                else:
-                    if self.status_flag != 0x03:
-                        self.relax(False)
-                    self.run_gait(self.command_queue)
-                    self.status_flag = 0x03
-            elif cmd.CMD_BALANCE in self.command_queue and len(self.command_queue) == 2:
-                if self.command_queue[1] == "1":
-                    self.command_queue = ['', '', '', '', '', '']
-                    if self.status_flag != 0x04:
-                        self.relax(False)
-                    self.status_flag = 0x04
-                    self.imu6050()
-            elif cmd.CMD_CALIBRATION in self.command_queue:
-                self.timeout = 0
-                self.calibrate()
-                self.set_leg_angles()
-                if len(self.command_queue) >= 2:
-                    if self.command_queue[1] == "one":
-                        self.calibration_leg_positions[0][0] = int(self.command_queue[2])
-                        self.calibration_leg_positions[0][1] = int(self.command_queue[3])
-                        self.calibration_leg_positions[0][2] = int(self.command_queue[4])
-                        self.calibrate()
-                        self.set_leg_angles()
-                    elif self.command_queue[1] == "two":
-                        self.calibration_leg_positions[1][0] = int(self.command_queue[2])
-                        self.calibration_leg_positions[1][1] = int(self.command_queue[3])
-                        self.calibration_leg_positions[1][2] = int(self.command_queue[4])
-                        self.calibrate()
-                        self.set_leg_angles()
-                    elif self.command_queue[1] == "three":
-                        self.calibration_leg_positions[2][0] = int(self.command_queue[2])
-                        self.calibration_leg_positions[2][1] = int(self.command_queue[3])
-                        self.calibration_leg_positions[2][2] = int(self.command_queue[4])
-                        self.calibrate()
-                        self.set_leg_angles()
-                    elif self.command_queue[1] == "four":
-                        self.calibration_leg_positions[3][0] = int(self.command_queue[2])
-                        self.calibration_leg_positions[3][1] = int(self.command_queue[3])
-                        self.calibration_leg_positions[3][2] = int(self.command_queue[4])
-                        self.calibrate()
-                        self.set_leg_angles()
-                    elif self.command_queue[1] == "five":
-                        self.calibration_leg_positions[4][0] = int(self.command_queue[2])
-                        self.calibration_leg_positions[4][1] = int(self.command_queue[3])
-                        self.calibration_leg_positions[4][2] = int(self.command_queue[4])
-                        self.calibrate()
-                        self.set_leg_angles()
-                    elif self.command_queue[1] == "six":
-                        self.calibration_leg_positions[5][0] = int(self.command_queue[2])
-                        self.calibration_leg_positions[5][1] = int(self.command_queue[3])
-                        self.calibration_leg_positions[5][2] = int(self.command_queue[4])
-                        self.calibrate()
-                        self.set_leg_angles()
-                    elif self.command_queue[1] == "save":
-                        self.save_to_txt(self.calibration_leg_positions, 'point')
-                self.command_queue = ['', '', '', '', '', '']
+            self.wait_for_command()
+            command = self.pending_command
+            if command is None:
+                if (time.time() - self.timeout) > 10 and self.timeout != 0:
+                    self.timeout = time.time()
+                    self.relax(True)
+                    self.status_flag = 0x00
+                continue
+            if command is not self.last_command:
+                self.last_command = command
+                self.latency_command = command
+            handler = self.command_handlers.get(command.name)
+            if handler is None:
+                self.clear_command(command)
+            else:
+                handler(command)
+
+    def handle_position(self, command):
+        if self.status_flag != 0x01:
+            self.relax(False)
+        x = self.restrict_value(command.args[0], -40, 40)
+        y = self.restrict_value(command.args[1], -40, 40)
+        z = self.restrict_value(command.args[2], -20, 20)
+        self.move_position(x, y, z)
+        self.status_flag = 0x01
+        self.clear_command(command)
+
+    def handle_attitude(self, command):
+        if self.status_flag != 0x02:
+            self.relax(False)
+        roll = self.restrict_value(command.args[0], -15, 15)
+        pitch = self.restrict_value(command.args[1], -15, 15)
+        yaw = self.restrict_value(command.args[2], -15, 15)
+        points = self.calculate_posture_balance(roll, pitch, yaw)
+        self.transform_coordinates(points)
+        self.set_leg_angles()
+        self.status_flag = 0x02
+        self.clear_command(command)
+
+    def handle_move(self, command):
+        # A move with zero step length is a stop: run it once, otherwise keep walking until replaced
+        if command.args[1] == 0 and command.args[2] == 0:
+            self.run_gait(command)
+            self.clear_command(command)
+        else:
+            if self.status_flag != 0x03:
+                self.relax(False)
+            self.run_gait(command)
+            self.status_flag = 0x03
+
+    def handle_balance(self, command):
+        self.clear_command(command)
+        if command.args[0] == 1:
+            if self.status_flag != 0x04:
+                self.relax(False)
+            self.status_flag = 0x04
+            self.imu6050()
+
+    def handle_calibration(self, command):
+        self.timeout = 0
+        self.calibrate()
+        self.set_leg_angles()
+        if len(command.args) == 4 and command.args[0] in self.CALIBRATION_LEGS:
+            leg = self.CALIBRATION_LEGS.index(command.args[0])
+            self.calibration_leg_positions[leg] = list(command.args[1:4])
+            self.calibrate()
+            self.set_leg_angles()
+        elif len(command.args) >= 1 and command.args[0] == "save":
+            self.save_to_txt(self.calibration_leg_positions, 'point')
+        self.clear_command(command)
 
     def relax(self, flag):
         if flag:
@@ -224,30 +221,7 @@ class Control:
             self.set_leg_angles()
 
     def transform_coordinates(self, points):
-        # Leg 1
-        self.leg_positions[0][0] = points[0][0] * math.cos(54 / 180 * math.pi) + points[0][1] * math.sin(54 / 180 * math.pi) - 94
-        self.leg_positions[0][1] = -points[0][0] * math.sin(54 / 180 * math.pi) + points[0][1] * math.cos(54 / 180 * math.pi)
-        self.leg_positions[0][2] = points[0][2] - 14
-        # Leg 2
-        self.leg_positions[1][0] = points[1][0] * math.cos(0 / 180 * math.pi) + points[1][1] * math.sin(0 / 180 * math.pi) - 85
-        self.leg_positions[1][1] = -points[1][0] * math.sin(0 / 180 * math.pi) + points[1][1] * math.cos(0 / 180 * math.pi)
-        self.leg_positions[1][2] = points[1][2] - 14
-        # Leg 3
-        self.leg_positions[2][0] = points[2][0] * math.cos(-54 / 180 * math.pi) + points[2][1] * math.sin(-54 / 180 * math.pi) - 94
-        self.leg_positions[2][1] = -points[2][0] * math.sin(-54 / 180 * math.pi) + points[2][1] * math.cos(-54 / 180 * math.pi)
-        self.leg_positions[2][2] = points[2][2] - 14
-        # Leg 4
-        self.leg_positions[3][0] = points[3][0] * math.cos(-126 / 180 * math.pi) + points[3][1] * math.sin(-126 / 180 * math.pi) - 94
-        self.leg_positions[3][1] = -points[3][0] * math.sin(-126 / 180 * math.pi) + points[3][1] * math.cos(-126 / 180 * math.pi)
-        self.leg_positions[3][2] = points[3][2] - 14
-        # Leg 5
-        self.leg_positions[4][0] = points[4][0] * math.cos(180 / 180 * math.pi) + points[4][1] * math.sin(180 / 180 * math.pi) - 85
-        self.leg_positions[4][1] = -points[4][0] * math.sin(180 / 180 * math.pi) + points[4][1] * math.cos(180 / 180 * math.pi)
-        self.leg_positions[4][2] = points[4][2] - 14
-        # Leg 6
-        self.leg_positions[5][0] = points[5][0] * math.cos(126 / 180 * math.pi) + points[5][1] * math.sin(126 / 180 * math.pi) - 94
-        self.leg_positions[5][1] = -points[5][0] * math.sin(126 / 180 * math.pi) + points[5][1] * math.cos(126 / 180 * math.pi)
-        self.leg_positions[5][2] = points[5][2] - 14
+        self.leg_positions = kinematics.body_to_leg_frame(points).tolist()
 
     def restrict_value(self, value, min_value, max_value):
         if value < min_value:
@@ -312,40 +286,78 @@ class Control:
         points = self.calculate_posture_balance(0, 0, 0)
         self.transform_coordinates(points)
         self.set_leg_angles()
-        time.sleep(2)
-        self.imu.Error_value_accel_data, self.imu.Error_value_gyro_data = self.imu.calculate_average_sensor_data()
-        time.sleep(1)
-        while True:
-            if self.command_queue[0] != "":
-                break
-            time.sleep(0.02)
-            roll, pitch, yaw = self.imu.update_imu_state()
-            roll = self.pid_controller.pid_calculate(roll)
-            pitch = self.pid_controller.pid_calculate(pitch)
-            points = self.calculate_posture_balance(roll, pitch, 0)
+        # The IMU bias comes from the saved calibration and is refined while the robot stands still
+        # Every FIFO sample is integrated, not just the one read per loop
+        self.imu.start_stream()
+        try:
+            while True:
+                if self.pending_command is not None:
+                    break
+                time.sleep(0.02)
+                roll, pitch, yaw = self.imu.update_imu_state()
+                roll = self.pid_controller.pid_calculate(roll)
+                pitch = self.pid_controller.pid_calculate(pitch)
+                points = self.calculate_posture_balance(roll, pitch, 0)
+                self.transform_coordinates(points)
+                self.set_leg_angles()
+        finally:
+            self.imu.stop_stream()
+
+    def run_gait(self, command, Z=40, F=64):  # Example: Command('CMD_MOVE', (1, 0, 25, 10, 0))
+        gait, x, y, speed, angle = command.args
+        x = self.restrict_value(x, -35, 35)
+        y = self.restrict_value(y, -35, 35)
+        if gait == 1:
+            F = round(self.map_value(speed, 2, 10, 126, 22))
+        else:
+            F = round(self.map_value(speed, 2, 10, 171, 45))
+        if x == 0 and y == 0 and angle == 0:
+            points = copy.deepcopy(self.body_points)
             self.transform_coordinates(points)
             self.set_leg_angles()
+            return
+        key = (gait, x, y, F, angle, Z, self.body_height)
+        cycle = self.gait_cache.get(key)
+        if cycle is None:
+            cycle = self.compile_gait(gait, x, y, F, angle, Z)
+            self.gait_cache.put(key, cycle)
+        self.gait_scheduler.start()
+        frame = 0
+        last_frame = len(cycle) - 1
+        while frame <= last_frame:
+            self.leg_positions = cycle.leg_positions[frame]
+            if cycle.valid[frame]:
+                self.current_angles = cycle.angles[frame]
+                self.write_servo_angles()
+            else:
+                print("This coordinate point is out of the active range")
+            missed = self.gait_scheduler.wait()
+            # Drop interpolation frames to stay on schedule, but always finish on the last frame
+            if frame < last_frame:
+                frame = min(frame + 1 + missed, last_frame)
+            else:
+                frame += 1
 
-    def run_gait(self, data, Z=40, F=64):  # Example: data=['CMD_MOVE', '1', '0', '25', '10', '0']
-        gait = data[1]
-        x = self.restrict_value(int(data[2]), -35, 35)
-        y = self.restrict_value(int(data[3]), -35, 35)
-        if gait == "1":
-            F = round(self.map_value(int(data[4]), 2, 10, 126, 22))
-        else:
-            F = round(self.map_value(int(data[4]), 2, 10, 171, 45))
-        angle = int(data[5])
+    def compile_gait(self, gait, x, y, F, angle, Z=40):
+        """Solve a whole gait cycle in one vectorized pass and return it as a GaitCycle."""
+        frames = self.generate_gait_points(gait, x, y, F, angle, Z)
+        if not frames:
+            return GaitCycle([], [], [])
+        leg_positions = kinematics.body_to_leg_frame(frames)
+        angles = kinematics.leg_positions_to_angles(leg_positions, self.calibration_angles)
+        valid = kinematics.check_leg_lengths(leg_positions)
+        return GaitCycle(leg_positions.tolist(), angles.tolist(), valid.tolist())
+
+    def generate_gait_points(self, gait, x, y, F, angle, Z=40):
+        """Return the body-frame foot positions of every frame in one gait cycle."""
         z = Z / F
-        delay = 0.01
         points = copy.deepcopy(self.body_points)
+        frames = []
         xy = [[0, 0], [0, 0], [0, 0], [0, 0], [0, 0], [0, 0]]
         for i in range(6):
             xy[i][0] = ((points[i][0] * math.cos(angle / 180 * math.pi) + points[i][1] * math.sin(angle / 180 * math.pi) - points[i][0]) + x) / F
             xy[i][1] = ((-points[i][0] * math.sin(angle / 180 * math.pi) + points[i][1] * math.cos(angle / 180 * math.pi) - points[i][1]) + y) / F
-        if x == 0 and y == 0 and angle == 0:
-            self.transform_coordinates(points)
-            self.set_leg_angles()
-        elif gait == "1":
+        if gait == 1:
             for j in range(F):
                 for i in range(3):
                     if j < (F / 8):
@@ -380,10 +392,8 @@ class Control:
                         points[2 * i][1] = points[2 * i][1] - 4 * xy[2 * i][1]
                         points[2 * i + 1][0] = points[2 * i + 1][0] + 8 * xy[2 * i + 1][0]
                         points[2 * i + 1][1] = points[2 * i + 1][1] + 8 * xy[2 * i + 1][1]
-                self.transform_coordinates(points)
-                self.set_leg_angles()
-                time.sleep(delay)
-        elif gait == "2":
+                frames.append(copy.deepcopy(points))
+        elif gait == 2:
             number = [5, 2, 1, 0, 3, 4]
             for i in range(6):
                 for j in range(int(F / 6)):
@@ -399,9 +409,8 @@ class Control:
                         else:
                             points[k][0] -= 2 * xy[k][0]
                             points[k][1] -= 2 * xy[k][1]
-                    self.transform_coordinates(points)
-                    self.set_leg_angles()
-                    time.sleep(delay)
+                    frames.append(copy.deepcopy(points))
+        return frames
 
 if __name__ == '__main__':
     pass
\ No newline at end of file
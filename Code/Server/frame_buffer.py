@@ -0,0 +1,161 @@
+# -*- coding: utf-8 -*-
+from threading import Condition, Lock
+
+_refs_lock = Lock()
+
+
+class Frame:
+    """
+    One encoded frame, shared by reference between the ring and the senders.
+
+    The ring holds one reference while the frame is in its slot and every
+    cursor read takes another one, which the sender drops with release()
+    once the payload is on the wire. The payload is a memoryview so it can
+    be handed to socket.sendmsg() without copying.
+    """
+    __slots__ = ('data', 'refs', 'on_release', 'keyframe')
+
+    def __init__(self, data, on_release=None, keyframe: bool = True):
+        self.data = memoryview(data)
+        self.refs = 1                # Owned by whoever publishes it
+        self.on_release = on_release # Called once the last reference is dropped
+        self.keyframe = keyframe     # A decoder can start here (always true for JPEG)
+
+    def __len__(self):
+        return self.data.nbytes
+
+    def acquire(self):
+        """Take a reference and return the frame."""
+        with _refs_lock:
+            self.refs += 1
+        return self
+
+    def release(self) -> None:
+        """Drop a reference; the payload is let go after the last one."""
+        with _refs_lock:
+            self.refs -= 1
+            last = self.refs == 0
+        if last:
+            self.data = None
+            if self.on_release is not None:
+                self.on_release(self)
+
+
+class FrameRingBuffer:
+    """
+    The last N encoded frames, shared by every video consumer.
+
+    Frames are numbered by a running sequence counter. The encoder publishes
+    each frame once and any number of FrameCursor readers consume them at
+    their own pace, so extra viewers do not add encoder load.
+    """
+
+    def __init__(self, size: int = 8):
+        self.size = size
+        self.frames = [None] * size
+        self.sequence = 0            # Sequence number the next published frame will get
+        self.condition = Condition()
+
+    def publish(self, frame: Frame) -> int:
+        """Store a frame, taking over the caller's reference, and wake waiting readers."""
+        with self.condition:
+            sequence = self.sequence
+            evicted = self.frames[sequence % self.size]
+            self.frames[sequence % self.size] = frame
+            self.sequence = sequence + 1
+            self.condition.notify_all()
+        if evicted is not None:
+            evicted.release()
+        return sequence
+
+    def latest(self):
+        """
+        Return (sequence, Frame) of the newest frame, or (-1, None).
+
+        A reference is taken for the caller, who must release() the frame when done with it.
+        """
+        with self.condition:
+            if self.sequence == 0:
+                return -1, None
+            return self.sequence - 1, self.frames[(self.sequence - 1) % self.size].acquire()
+
+
+class FrameCursor:
+    """
+    One consumer's read position in a FrameRingBuffer.
+
+    A cursor reads frames in order while it keeps up. Once it is more than
+    max_lag frames behind the newest one it jumps straight to the newest
+    frame and counts the skipped ones as dropped. Use max_lag=0 for live
+    viewers and the default (the buffer size) for consumers that want every
+    frame the buffer still holds.
+
+    Skips only ever land on a keyframe, so inter-coded streams such as H.264
+    stay decodable: a cursor starts at the first keyframe it sees, and if
+    no newer keyframe is held it keeps reading in order until the frames it
+    needs are overwritten.
+    """
+    __slots__ = ('buffer', 'position', 'max_lag', 'delivered', 'dropped', 'need_keyframe')
+
+    def __init__(self, buffer: FrameRingBuffer, max_lag: int = None):
+        self.buffer = buffer
+        self.position = buffer.sequence  # Start with the next frame to be published
+        self.max_lag = buffer.size - 1 if max_lag is None else min(max_lag, buffer.size - 1)
+        self.delivered = 0
+        self.dropped = 0
+        self.need_keyframe = True
+
+    def poll(self):
+        """
+        Return the next frame for this cursor without blocking, or None if there is none yet.
+
+        The returned Frame carries a reference that the caller must release().
+        """
+        with self.buffer.condition:
+            return self._take()
+
+    def next_frame(self, timeout: float = None):
+        """Block until a frame is available for this cursor; return None on timeout."""
+        with self.buffer.condition:
+            if self.position >= self.buffer.sequence:
+                self.buffer.condition.wait_for(lambda: self.position < self.buffer.sequence, timeout)
+            return self._take()
+
+    def _take(self):
+        newest = self.buffer.sequence - 1
+        if self.position > newest:
+            return None
+        if newest - self.position > self.max_lag:
+            self._skip_ahead(newest)
+        frames = self.buffer.frames
+        size = self.buffer.size
+        while self.need_keyframe and self.position <= newest:
+            if frames[self.position % size].keyframe:
+                self.need_keyframe = False
+            else:
+                self.position += 1
+                self.dropped += 1
+        if self.position > newest:
+            return None
+        frame = frames[self.position % size].acquire()
+        self.position += 1
+        self.delivered += 1
+        return frame
+
+    def _skip_ahead(self, newest: int) -> None:
+        frames = self.buffer.frames
+        size = self.buffer.size
+        oldest = max(0, self.buffer.sequence - size)
+        lower = max(self.position, oldest)
+        target = newest
+        while target > lower and not frames[target % size].keyframe:
+            target -= 1
+        if target > self.position and frames[target % size].keyframe:
+            self.dropped += target - self.position
+            self.position = target
+        elif self.position < oldest:
+            # The frames it needs are gone and no keyframe is held to resume from
+            self.dropped += newest - self.position
+            self.position = newest
+            self.need_keyframe = True
+        # Otherwise keep reading in order while the frames are still held
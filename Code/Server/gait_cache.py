@@ -0,0 +1,49 @@
+# -*- coding: utf-8 -*-
+from collections import OrderedDict
+
+
+class GaitCycle:
+    """A compiled gait cycle: per-frame leg positions, servo angles and reach validity."""
+    __slots__ = ('leg_positions', 'angles', 'valid')
+
+    def __init__(self, leg_positions, angles, valid):
+        self.leg_positions = leg_positions  # N x 6 x 3 leg-frame foot positions
+        self.angles = angles                # N x 6 x 3 calibrated servo angles
+        self.valid = valid                  # N flags, False where a foot is out of reach
+
+    def __len__(self):
+        return len(self.angles)
+
+
+class GaitCache:
+    """Bounded LRU cache of compiled gait cycles."""
+
+    def __init__(self, max_size: int = 32):
+        self.max_size = max_size
+        self.cycles = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        """Return the cached cycle for key, or None if it has not been compiled yet."""
+        cycle = self.cycles.get(key)
+        if cycle is None:
+            self.misses += 1
+            return None
+        self.cycles.move_to_end(key)
+        self.hits += 1
+        return cycle
+
+    def put(self, key, cycle: GaitCycle) -> None:
+        """Store a compiled cycle, evicting the least recently used one when full."""
+        self.cycles[key] = cycle
+        self.cycles.move_to_end(key)
+        while len(self.cycles) > self.max_size:
+            self.cycles.popitem(last=False)
+
+    def clear(self) -> None:
+        """Drop every cached cycle, e.g. after the calibration changed."""
+        self.cycles.clear()
+
+    def __len__(self):
+        return len(self.cycles)
@@ -2,40 +2,66 @@
 import time
 import math
 import os
-from kalman import Kalman_filter
+import json
+import threading
+from collections import deque
+import numpy as np
+from kalman import KalmanBank
+from mahony import MahonyFilter
 from mpu6050 import mpu6050
 
 class IMU:
-    def __init__(self):
-        self.proportional_gain = 100 
-        self.integral_gain = 0.002 
-        self.half_time_step = 0.001 
-
-        self.quaternion_w = 1
-        self.quaternion_x = 0
-        self.quaternion_y = 0
-        self.quaternion_z = 0
-
-        self.integral_error_x = 0
-        self.integral_error_y = 0
-        self.integral_error_z = 0
+    CALIBRATION_FILE = 'imu_calibration.json'
+    GRAVITY = 9.8
+
+    def __init__(self, calibration_file=CALIBRATION_FILE):
+        self.attitude = MahonyFilter()   # Integrates over the measured time between samples
+        self.polling_default_dt = self.attitude.default_dt
         self.pitch_angle = 0
         self.roll_angle = 0
         self.yaw_angle = 0
+        self.last_update = 0.0           # Monotonic time of the last filter update
+        self.lock = threading.RLock()    # The balance loop and telemetry share this filter
+        # FIFO streaming: a reader thread drains the chip into timestamped samples
+        self.stream_thread = None
+        self.stream_stop = threading.Event()
+        self.stream_lock = threading.Lock()
+        self.stream_samples = deque(maxlen=1024)  # (monotonic timestamp, ax, ay, az, gx, gy, gz)
+        self.stream_period = None
     
         self.sensor = mpu6050(address=0x68, bus=1) 
         self.sensor.set_accel_range(mpu6050.ACCEL_RANGE_2G)   
         self.sensor.set_gyro_range(mpu6050.GYRO_RANGE_250DEG)  
     
-        self.kalman_filter_AX = Kalman_filter(0.001, 0.1)
-        self.kalman_filter_AY = Kalman_filter(0.001, 0.1)
-        self.kalman_filter_AZ = Kalman_filter(0.001, 0.1)
+        # One filter channel per axis: ax, ay, az, gx, gy, gz
+        self.kalman_filters = KalmanBank(6, 0.001, 0.1)
 
-        self.kalman_filter_GX = Kalman_filter(0.001, 0.1)
-        self.kalman_filter_GY = Kalman_filter(0.001, 0.1)
-        self.kalman_filter_GZ = Kalman_filter(0.001, 0.1)
-    
-        self.error_accel_data, self.error_gyro_data = self.calculate_average_sensor_data()
+        # Bias calibration, persisted so startup does not have to sample it
+        self.calibration_file = calibration_file
+        self.calibration_max_age = 7 * 24 * 3600   # Seconds a saved calibration stays usable
+        self.calibration_max_temperature_change = 5.0  # Degrees C; the gyro bias drifts with temperature
+        self.bias = np.zeros(6)              # ax, ay, az, gx, gy, gz
+        self.calibrated = False
+        self.calibration_thread = None
+        self.temperature = None
+        # Wall-clock time and temperature of each half of the bias; online refinement only renews the gyro half
+        self.accel_calibrated_at = None
+        self.accel_temperature = None
+        self.gyro_calibrated_at = None
+        self.gyro_temperature = None
+        # Online gyro bias refinement while the robot is still
+        self.still_gyro = 2.0                # deg/s away from the bias on every axis
+        self.still_accel = 0.5               # m/s^2 away from 1 g
+        self.still_time = 1.0                # Seconds of stillness before refining
+        self.refine_time_constant = 30.0     # Seconds; how slowly the bias follows
+        self.still_since = None
+        self.last_refine = None
+        self.save_interval = 300.0           # Seconds between saves of a refined bias
+        self.last_save = time.monotonic()
+        self.bias_changed = False
+
+        if not self.load_calibration():
+            self.start_calibration()
     
     def calculate_average_sensor_data(self):
         accel_x_sum = 0
@@ -47,8 +73,7 @@ class IMU:
         gyro_z_sum = 0
         
         for _ in range(100):
-            accel_data = self.sensor.get_accel_data()   
-            gyro_data = self.sensor.get_gyro_data()      
+            accel_data, gyro_data, temperature = self.sensor.get_all_data_burst()
             
             accel_x_sum += accel_data['x']
             accel_y_sum += accel_data['y']
@@ -75,58 +100,217 @@ class IMU:
         gyro_data['z'] = gyro_z_avg
         return accel_data, gyro_data
 
+    def calibrate(self):
+        """Measure the bias now and save it. The robot must be level and still."""
+        accel_data, gyro_data = self.calculate_average_sensor_data()
+        temperature = self.sensor.get_temp()
+        now = time.time()
+        with self.lock:
+            self.bias = np.array([accel_data['x'], accel_data['y'], accel_data['z'], gyro_data['x'], gyro_data['y'], gyro_data['z']])
+            self.temperature = temperature
+            self.accel_calibrated_at = self.gyro_calibrated_at = now
+            self.accel_temperature = self.gyro_temperature = temperature
+            self.calibrated = True
+            self.bias_changed = True
+        self.save_calibration()
+
+    def start_calibration(self):
+        """Calibrate in a background thread; until it finishes the bias is zero or the previous one."""
+        if self.calibration_thread is None or not self.calibration_thread.is_alive():
+            self.calibration_thread = threading.Thread(target=self._run_calibration, name='imu-calibration', daemon=True)
+            self.calibration_thread.start()
+
+    def _run_calibration(self):
+        try:
+            self.calibrate()
+        except Exception as e:
+            print(e)
+
+    def load_calibration(self):
+        """
+        Use the saved bias if both halves are recent and were measured near the current temperature.
+
+        The accelerometer half is aged from the last full calibrate(), since refining while still does not renew it.
+        Returns True if the saved bias was used.
+        """
+        try:
+            with open(self.calibration_file, 'r') as file:
+                calibration = json.load(file)
+            bias = np.array(calibration['bias'], dtype=float).reshape(6)
+            accel = calibration['accel']
+            gyro = calibration['gyro']
+            temperature = self.sensor.get_temp()
+        except FileNotFoundError:
+            return False
+        except Exception as e:
+            print(f"Error reading IMU calibration: {e}")
+            return False
+        now = time.time()
+        for part in (accel, gyro):
+            if now - part['timestamp'] > self.calibration_max_age or abs(temperature - part['temperature']) > self.calibration_max_temperature_change:
+                return False
+        with self.lock:
+            self.bias = bias
+            self.temperature = temperature
+            self.accel_calibrated_at, self.accel_temperature = accel['timestamp'], accel['temperature']
+            self.gyro_calibrated_at, self.gyro_temperature = gyro['timestamp'], gyro['temperature']
+            self.calibrated = True
+        return True
+
+    def save_calibration(self):
+        """Write the bias with the timestamp and temperature of its accelerometer and gyro halves."""
+        with self.lock:
+            calibration = {
+                'bias': self.bias.tolist(),
+                'accel': {'timestamp': self.accel_calibrated_at, 'temperature': self.accel_temperature},
+                'gyro': {'timestamp': self.gyro_calibrated_at, 'temperature': self.gyro_temperature},
+            }
+            self.bias_changed = False
+            self.last_save = time.monotonic()
+        try:
+            # Write a temporary file first so an interrupted save cannot leave a broken calibration
+            temporary = self.calibration_file + '.tmp'
+            with open(temporary, 'w') as file:
+                json.dump(calibration, file, indent=4)
+            os.replace(temporary, self.calibration_file)
+        except Exception as e:
+            print(f"Error saving IMU calibration: {e}")
+
+    def _refine_bias(self, timestamps, raw):
+        """
+        Pull the gyro bias towards the mean rate of a block of raw samples taken while the robot is still.
+
+        Takes self.lock itself, so a refinement step cannot race a background calibrate() replacing the bias.
+        """
+        accel_norm = np.linalg.norm(raw[:, :3], axis=1)
+        with self.lock:
+            still = np.all(np.abs(raw[:, 3:] - self.bias[3:]) < self.still_gyro) and np.all(np.abs(accel_norm - self.GRAVITY) < self.still_accel)
+            if not still or not self.calibrated:
+                self.still_since = None
+                return
+            if self.still_since is None:
+                self.still_since = timestamps[0]
+            now = timestamps[-1]
+            start = self.still_since + self.still_time
+            if self.last_refine is not None:
+                start = max(start, self.last_refine)
+            if now <= start:
+                return
+            weight = 1.0 - math.exp(-(now - start) / self.refine_time_constant)
+            self.bias[3:] += weight * (raw[:, 3:].mean(axis=0) - self.bias[3:])
+            self.last_refine = now
+            self.bias_changed = True
+            if time.monotonic() - self.last_save <= self.save_interval:
+                return
+            self.last_save = time.monotonic()
+        threading.Thread(target=self._save_refined_bias, name='imu-calibration-save', daemon=True).start()
+
+    def _save_refined_bias(self):
+        try:
+            temperature = self.sensor.get_temp()
+        except Exception as e:
+            print(e)
+            return
+        with self.lock:
+            self.temperature = temperature
+            self.gyro_calibrated_at = time.time()
+            self.gyro_temperature = temperature
+        self.save_calibration()
+
+    def start_stream(self, sample_rate=200, poll_interval=0.02, buffer_size=1024):
+        """
+        Sample into the chip FIFO at sample_rate and drain it every poll_interval seconds.
+
+        While streaming, update_imu_state() integrates every buffered sample instead of polling one.
+        Returns the sample rate the chip actually uses.
+        """
+        if self.stream_thread is not None:
+            return 1.0 / self.stream_period
+        with self.stream_lock:
+            self.stream_samples = deque(maxlen=buffer_size)
+        sample_rate = self.sensor.enable_fifo(sample_rate)
+        self.stream_period = 1.0 / sample_rate
+        with self.lock:
+            # A bad time step falls back to the real sample period, not the polling loop period
+            self.attitude.default_dt = self.stream_period
+        self.stream_stop.clear()
+        self.stream_thread = threading.Thread(target=self._stream_loop, args=(poll_interval,), name='imu-fifo', daemon=True)
+        self.stream_thread.start()
+        return sample_rate
+
+    def stop_stream(self):
+        """Stop the FIFO reader and go back to polling."""
+        if self.stream_thread is None:
+            return
+        self.stream_stop.set()
+        self.stream_thread.join()
+        self.stream_thread = None
+        self.sensor.disable_fifo()
+        with self.lock:
+            self.attitude.default_dt = self.polling_default_dt
+        with self.stream_lock:
+            self.stream_samples.clear()
+
+    def drain_samples(self):
+        """Remove and return every buffered (timestamp, ax, ay, az, gx, gy, gz) sample, oldest first."""
+        with self.stream_lock:
+            samples = list(self.stream_samples)
+            self.stream_samples.clear()
+        return samples
+
+    def _stream_loop(self, poll_interval):
+        while not self.stream_stop.wait(poll_interval):
+            # The FIFO holds no timestamps: the newest sample was taken no later than the FIFO count read,
+            # so stamp before it (a long drain must not push the stamps later), older ones one period apart
+            now = time.monotonic()
+            try:
+                samples = self.sensor.read_fifo()
+            except Exception as e:
+                print(e)
+                continue
+            last = len(samples) - 1
+            with self.stream_lock:
+                for i, sample in enumerate(samples):
+                    self.stream_samples.append((now - (last - i) * self.stream_period,) + sample)
+
     def update_imu_state(self):
-        accel_data = self.sensor.get_accel_data()    
-        gyro_data = self.sensor.get_gyro_data() 
-        
-        accel_x = self.kalman_filter_AX.kalman(accel_data['x'] - self.error_accel_data['x'])
-        accel_y = self.kalman_filter_AY.kalman(accel_data['y'] - self.error_accel_data['y'])
-        accel_z = self.kalman_filter_AZ.kalman(accel_data['z'] - self.error_accel_data['z'])
-        gyro_x = self.kalman_filter_GX.kalman(gyro_data['x'] - self.error_gyro_data['x'])
-        gyro_y = self.kalman_filter_GY.kalman(gyro_data['y'] - self.error_gyro_data['y'])
-        gyro_z = self.kalman_filter_GZ.kalman(gyro_data['z'] - self.error_gyro_data['z'])
-
-        accel_norm = math.sqrt(accel_x * accel_x + accel_y * accel_y + accel_z * accel_z)
-        
-        accel_x /= accel_norm
-        accel_y /= accel_norm
-        accel_z /= accel_norm
-        
-        quat_vx = 2 * (self.quaternion_x * self.quaternion_z - self.quaternion_w * self.quaternion_y)
-        quat_vy = 2 * (self.quaternion_w * self.quaternion_x + self.quaternion_y * self.quaternion_z)
-        quat_vz = self.quaternion_w * self.quaternion_w - self.quaternion_x * self.quaternion_x - self.quaternion_y * self.quaternion_y + self.quaternion_z * self.quaternion_z
-        
-        error_x = (accel_y * quat_vz - accel_z * quat_vy)
-        error_y = (accel_z * quat_vx - accel_x * quat_vz)
-        error_z = (accel_x * quat_vy - accel_y * quat_vx)
-        
-        self.integral_error_x += error_x * self.integral_gain
-        self.integral_error_y += error_y * self.integral_gain
-        self.integral_error_z += error_z * self.integral_gain
-        
-        gyro_x += self.proportional_gain * error_x + self.integral_error_x
-        gyro_y += self.proportional_gain * error_y + self.integral_error_y
-        gyro_z += self.proportional_gain * error_z + self.integral_error_z
-        
-        self.quaternion_w += (-self.quaternion_x * gyro_x - self.quaternion_y * gyro_y - self.quaternion_z * gyro_z) * self.half_time_step
-        self.quaternion_x += (self.quaternion_w * gyro_x + self.quaternion_y * gyro_z - self.quaternion_z * gyro_y) * self.half_time_step
-        self.quaternion_y += (self.quaternion_w * gyro_y - self.quaternion_x * gyro_z + self.quaternion_z * gyro_x) * self.half_time_step
-        self.quaternion_z += (self.quaternion_w * gyro_z + self.quaternion_x * gyro_y - self.quaternion_y * self.quaternion_x) * self.half_time_step
-        
-        norm = math.sqrt(self.quaternion_w * self.quaternion_w + self.quaternion_x * self.quaternion_x + self.quaternion_y * self.quaternion_y + self.quaternion_z * self.quaternion_z)
-        self.quaternion_w /= norm
-        self.quaternion_x /= norm
-        self.quaternion_y /= norm
-        self.quaternion_z /= norm
-        
-        current_pitch = math.asin(-2 * self.quaternion_x * self.quaternion_z + 2 * self.quaternion_w * self.quaternion_y) * 57.3
-        current_roll = math.atan2(2 * self.quaternion_y * self.quaternion_z + 2 * self.quaternion_w * self.quaternion_x, -2 * self.quaternion_x * self.quaternion_x - 2 * self.quaternion_y * self.quaternion_y + 1) * 57.3
-        current_yaw = math.atan2(2 * (self.quaternion_x * self.quaternion_y + self.quaternion_w * self.quaternion_z), self.quaternion_w * self.quaternion_w + self.quaternion_x * self.quaternion_x - self.quaternion_y * self.quaternion_y - self.quaternion_z * self.quaternion_z) * 57.3
-        self.pitch_angle = current_pitch
-        self.roll_angle = current_roll
-        self.yaw_angle = current_yaw
+        with self.lock:
+            return self._update_imu_state()
+
+    def read_angles(self, max_age):
+        """Return (pitch, roll, yaw), stepping the filter only if nobody did within max_age seconds."""
+        with self.lock:
+            if time.monotonic() - self.last_update > max_age:
+                self._update_imu_state()
+            return self.pitch_angle, self.roll_angle, self.yaw_angle
+
+    def _update_imu_state(self):
+        if self.stream_thread is not None:
+            samples = self.drain_samples()
+            if not samples:
+                return self.pitch_angle, self.roll_angle, self.yaw_angle
+            block = np.array(samples)
+            self._refine_bias(block[:, 0], block[:, 1:])
+            block[:, 1:] = self.kalman_filters.kalman_block(block[:, 1:] - self.bias)
+            angles = self.attitude.update_block(block)
+        else:
+            timestamp = time.monotonic()
+            # One 14 byte burst, scaled with the ranges the driver cached
+            sample = self.sensor.get_motion()
+            self.temperature = sample[6]
+            raw = np.array([sample[:6]])
+            self._refine_bias([timestamp], raw)
+            ax, ay, az, gx, gy, gz = self.kalman_filters.kalman((raw[0] - self.bias).tolist())
+            angles = self.attitude.update(ax, ay, az, gx, gy, gz, timestamp=timestamp)
+        self.pitch_angle, self.roll_angle, self.yaw_angle = angles
+        self.last_update = time.monotonic()
         return self.pitch_angle, self.roll_angle, self.yaw_angle
 
+    def get_bias(self):
+        """Return a copy of the (ax, ay, az, gx, gy, gz) bias."""
+        with self.lock:
+            return self.bias.copy()
+
     def handle_exception(self, exception):
         print(exception)
         os.system("i2cdetect -y 1")
@@ -1,3 +1,5 @@
+import numpy as np
+
 class Kalman_filter:
     def __init__(self, process_noise_covariance, measurement_noise_covariance):
         self.process_noise_covariance = process_noise_covariance  # Process noise covariance (Q)
@@ -29,6 +31,84 @@ class Kalman_filter:
         self.previous_kalman_output = kalman_output
         return kalman_output
 
+class KalmanBank:
+    """
+    Kalman_filter for several channels at once, filtering a whole sample vector or block per call.
+
+    The gain sequence depends only on P, Q and R, never on the data, so it is
+    computed once per block and shared by every channel with the same tuning.
+    The output recurrence then runs as a plain float loop per channel, which
+    is cheaper than NumPy calls on six-element arrays.
+    """
+    def __init__(self, channels, process_noise_covariance, measurement_noise_covariance):
+        # Scalars apply to every channel, sequences set them per channel
+        self.process_noise_covariance = np.broadcast_to(np.asarray(process_noise_covariance, dtype=float), (channels,)).tolist()  # Q
+        self.measurement_noise_covariance = np.broadcast_to(np.asarray(measurement_noise_covariance, dtype=float), (channels,)).tolist()  # R
+        self.posterior_error_covariance = [1.0] * channels  # P_k1_k1
+        self.previous_kalman_output = [0.0] * channels  # x_k1_k1
+
+    def kalman(self, values):
+        """Filter one sample per channel (a list is fastest) and return the outputs as a list."""
+        process_noise_covariance = self.process_noise_covariance
+        measurement_noise_covariance = self.measurement_noise_covariance
+        posterior_error_covariance = self.posterior_error_covariance
+        previous_kalman_output = self.previous_kalman_output
+        outputs = []
+        for channel, value in enumerate(values):
+            previous = previous_kalman_output[channel]
+            if abs(previous - value) >= 60:
+                estimate = value * 0.400 + previous * 0.600
+            else:
+                estimate = previous
+            estimated_error_covariance = posterior_error_covariance[channel] + process_noise_covariance[channel]
+            kalman_gain = estimated_error_covariance / (estimated_error_covariance + measurement_noise_covariance[channel])
+            posterior_error_covariance[channel] = (1 - kalman_gain) * estimated_error_covariance
+            previous = float(estimate + kalman_gain * (value - previous))
+            previous_kalman_output[channel] = previous
+            outputs.append(previous)
+        return outputs
+
+    def kalman_block(self, block):
+        """Filter a (samples, channels) block, oldest row first, and return the outputs as an array of the same shape."""
+        block = np.asarray(block, dtype=float)
+        if len(block) == 0:
+            return block.copy()
+        return np.array(self._filter_columns(block.T.tolist())).T
+
+    def _filter_columns(self, columns):
+        gains = {}
+        outputs = []
+        for channel, column in enumerate(columns):
+            tuning = (self.posterior_error_covariance[channel], self.process_noise_covariance[channel], self.measurement_noise_covariance[channel])
+            if tuning not in gains:
+                gains[tuning] = self._gain_sequence(len(column), *tuning)
+            kalman_gains, posterior_error_covariance = gains[tuning]
+            previous = self.previous_kalman_output[channel]
+            output = []
+            for value, kalman_gain in zip(column, kalman_gains):
+                # Large changes pull the prediction 40% towards the measurement, as in Kalman_filter
+                if abs(previous - value) >= 60:
+                    estimate = value * 0.400 + previous * 0.600
+                else:
+                    estimate = previous
+                previous = estimate + kalman_gain * (value - previous)
+                output.append(previous)
+            self.previous_kalman_output[channel] = previous
+            self.posterior_error_covariance[channel] = posterior_error_covariance
+            outputs.append(output)
+        return outputs
+
+    @staticmethod
+    def _gain_sequence(length, posterior_error_covariance, process_noise_covariance, measurement_noise_covariance):
+        """Return the next length Kalman gains and the error covariance after them."""
+        kalman_gains = []
+        for _ in range(length):
+            estimated_error_covariance = posterior_error_covariance + process_noise_covariance
+            kalman_gain = estimated_error_covariance / (estimated_error_covariance + measurement_noise_covariance)
+            posterior_error_covariance = (1 - kalman_gain) * estimated_error_covariance
+            kalman_gains.append(kalman_gain)
+        return kalman_gains, posterior_error_covariance
+
 if __name__ == '__main__':
     kalman_filter = Kalman_filter(0.001, 0.1)
     for i in range(100):
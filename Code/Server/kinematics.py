@@ -0,0 +1,101 @@
+# -*- coding: utf-8 -*-
+"""
+Vectorized leg kinematics for the hexapod.
+
+The functions here mirror Control.coordinate_to_angle and the calibration /
+mirroring done in Control.set_leg_angles, but operate on whole arrays so a
+gait frame (6, 3) or a complete trajectory (N, 6, 3) is solved in one pass.
+"""
+import numpy as np
+
+# Leg segment lengths in millimetres (coxa, femur, tibia)
+L1 = 33
+L2 = 90
+L3 = 110
+
+# Mounting angle (degrees) and coxa offset (mm) of legs 1-6 on the body
+LEG_MOUNT_ANGLES = np.array([54, 0, -54, -126, 180, 126])
+LEG_MOUNT_OFFSETS = np.array([94, 85, 94, 94, 85, 94])
+LEG_HEIGHT_OFFSET = 14
+
+# Reachable range of the foot measured from the coxa joint
+MIN_LEG_LENGTH = 90
+MAX_LEG_LENGTH = 248
+
+
+def coordinate_to_angle(points, l1=L1, l2=L2, l3=L3):
+    """
+    Inverse kinematics for any number of legs at once.
+
+    :param points: Array of shape (..., 3) holding (x, y, z) in the IK frame,
+                   i.e. the same arguments Control.coordinate_to_angle takes.
+    :return: Integer array of shape (..., 3) with the (a, b, c) joint angles in degrees.
+    """
+    points = np.asarray(points, dtype=float)
+    x = points[..., 0]
+    y = points[..., 1]
+    z = points[..., 2]
+    a = np.pi / 2 - np.arctan2(z, y)
+    x_4 = l1 * np.sin(a)
+    x_5 = l1 * np.cos(a)
+    l23 = np.sqrt((z - x_5) ** 2 + (y - x_4) ** 2 + x ** 2)
+    # Cosines are rounded to two decimals to match the scalar implementation
+    w = np.round(np.clip(x / l23, -1, 1), 2)
+    v = np.round(np.clip((l2 * l2 + l23 * l23 - l3 * l3) / (2 * l2 * l23), -1, 1), 2)
+    u = np.round(np.clip((l2 ** 2 + l3 ** 2 - l23 ** 2) / (2 * l3 * l2), -1, 1), 2)
+    b = np.arcsin(w) - np.arccos(v)
+    c = np.pi - np.arccos(u)
+    angles = np.stack((a, b, c), axis=-1)
+    return np.rint(np.degrees(angles)).astype(int)
+
+
+def body_to_leg_frame(points):
+    """
+    Vectorized Control.transform_coordinates.
+
+    :param points: Body-frame foot positions of shape (6, 3) or (N, 6, 3).
+    :return: Float array of the same shape with foot positions in each leg's own frame.
+    """
+    points = np.asarray(points, dtype=float)
+    theta = LEG_MOUNT_ANGLES / 180 * np.pi
+    cos_theta = np.cos(theta)
+    sin_theta = np.sin(theta)
+    leg_positions = np.empty_like(points)
+    leg_positions[..., 0] = points[..., 0] * cos_theta + points[..., 1] * sin_theta - LEG_MOUNT_OFFSETS
+    leg_positions[..., 1] = -points[..., 0] * sin_theta + points[..., 1] * cos_theta
+    leg_positions[..., 2] = points[..., 2] - LEG_HEIGHT_OFFSET
+    return leg_positions
+
+
+def to_ik_frame(leg_positions):
+    """Reorder leg-frame (x, y, z) positions into the (-z, x, y) order the IK expects."""
+    leg_positions = np.asarray(leg_positions, dtype=float)
+    return np.stack((-leg_positions[..., 2], leg_positions[..., 0], leg_positions[..., 1]), axis=-1)
+
+
+def leg_positions_to_angles(leg_positions, calibration_angles):
+    """
+    Convert leg-frame foot positions into calibrated servo angles.
+
+    :param leg_positions: Array of shape (6, 3) or (N, 6, 3), as stored in Control.leg_positions.
+    :param calibration_angles: Array of shape (6, 3), as stored in Control.calibration_angles.
+    :return: Integer array with the same leading shape holding servo angles restricted to 0-180.
+    """
+    angles = coordinate_to_angle(to_ik_frame(leg_positions)) + np.asarray(calibration_angles, dtype=int)
+    # Legs 1-3 sit on the right side, legs 4-6 are mounted mirrored on the left
+    angles[..., :3, 1] = 90 - angles[..., :3, 1]
+    angles[..., 3:, 1] = 90 + angles[..., 3:, 1]
+    angles[..., 3:, 2] = 180 - angles[..., 3:, 2]
+    return np.clip(angles, 0, 180)
+
+
+def check_leg_lengths(leg_positions):
+    """
+    Check that every foot is inside the reachable range.
+
+    :param leg_positions: Array of shape (6, 3) or (N, 6, 3).
+    :return: A bool for a single frame, or a bool array of shape (N,) for a trajectory.
+    """
+    lengths = np.linalg.norm(np.asarray(leg_positions, dtype=float), axis=-1)
+    valid = np.all((lengths >= MIN_LEG_LENGTH) & (lengths <= MAX_LEG_LENGTH), axis=-1)
+    return valid if valid.ndim else bool(valid)
@@ -0,0 +1,134 @@
+# -*- coding: utf-8 -*-
+import math
+import time
+import numpy as np
+
+
+def mahony_step(qw, qx, qy, qz, ix, iy, iz, ax, ay, az, gx, gy, gz, dt, kp, ki):
+    """
+    Advance the quaternion (qw, qx, qy, qz) and integral error (ix, iy, iz) by one sample.
+
+    Gyro rates are in rad/s. Returns the new (qw, qx, qy, qz, ix, iy, iz).
+    """
+    norm = math.sqrt(ax * ax + ay * ay + az * az)
+    if norm > 0:
+        ax, ay, az = ax / norm, ay / norm, az / norm
+        # Gravity direction predicted by the current orientation
+        vx = 2 * (qx * qz - qw * qy)
+        vy = 2 * (qw * qx + qy * qz)
+        vz = qw * qw - qx * qx - qy * qy + qz * qz
+        ex = ay * vz - az * vy
+        ey = az * vx - ax * vz
+        ez = ax * vy - ay * vx
+        ix += ki * ex * dt
+        iy += ki * ey * dt
+        iz += ki * ez * dt
+        gx += kp * ex + ix
+        gy += kp * ey + iy
+        gz += kp * ez + iz
+    half_dt = 0.5 * dt
+    qw, qx, qy, qz = (qw + (-qx * gx - qy * gy - qz * gz) * half_dt,
+                      qx + (qw * gx + qy * gz - qz * gy) * half_dt,
+                      qy + (qw * gy - qx * gz + qz * gx) * half_dt,
+                      qz + (qw * gz + qx * gy - qy * gx) * half_dt)
+    norm = math.sqrt(qw * qw + qx * qx + qy * qy + qz * qz)
+    return qw / norm, qx / norm, qy / norm, qz / norm, ix, iy, iz
+
+
+class MahonyFilter:
+    """
+    Mahony attitude filter driven by measured time steps.
+
+    Each sample carries a monotonic timestamp and the quaternion is integrated
+    over the real interval since the previous one, so the estimate does not
+    depend on how often the filter is called. Gyro rates are in degrees per
+    second, acceleration in any unit (it is normalized).
+
+    The default gains give the same proportional and integral correction per
+    sample as the old fixed step filter (proportional_gain = 100, integral_gain
+    = 0.002, half_time_step = 0.001) in the 50 Hz balance loop.
+    """
+
+    def __init__(self, proportional_gain: float = 10.0, integral_gain: float = 0.01, default_dt: float = 0.02, max_dt: float = 0.1):
+        self.proportional_gain = proportional_gain
+        self.integral_gain = integral_gain
+        self.default_dt = default_dt  # Step used when the timestamps are unusable
+        self.max_dt = max_dt          # Longer gaps are clamped so a pause does not look like a rotation
+        self.quaternion = [1.0, 0.0, 0.0, 0.0]
+        self.integral_error = [0.0, 0.0, 0.0]
+        self.last_timestamp = None
+        self.samples = 0
+        self.busy_time = 0.0      # Seconds spent inside update calls
+        self.sample_time = 0.0    # Sensor time covered by the samples
+
+    def reset(self) -> None:
+        """Forget the orientation and timing."""
+        self.quaternion = [1.0, 0.0, 0.0, 0.0]
+        self.integral_error = [0.0, 0.0, 0.0]
+        self.last_timestamp = None
+
+    def update(self, ax, ay, az, gx, gy, gz, timestamp: float = None) -> tuple:
+        """Integrate one sample taken at the monotonic time timestamp (now if None) and return (pitch, roll, yaw)."""
+        start = time.perf_counter()
+        if timestamp is None:
+            timestamp = time.monotonic()
+        dt = 0.0 if self.last_timestamp is None else timestamp - self.last_timestamp
+        if dt < 0 or dt > self.max_dt:
+            dt = self.default_dt
+        state = mahony_step(*self.quaternion, *self.integral_error, ax, ay, az,
+                            math.radians(gx), math.radians(gy), math.radians(gz),
+                            dt, self.proportional_gain, self.integral_gain)
+        self.quaternion = list(state[:4])
+        self.integral_error = list(state[4:])
+        self.last_timestamp = timestamp
+        self.samples += 1
+        self.sample_time += dt
+        self.busy_time += time.perf_counter() - start
+        return self.get_angles()
+
+    def update_block(self, samples) -> tuple:
+        """
+        Integrate a block of samples and return (pitch, roll, yaw) in degrees after the last one.
+
+        :param samples: Array-like of rows (timestamp, ax, ay, az, gx, gy, gz), oldest first.
+        """
+        start = time.perf_counter()
+        samples = np.asarray(samples, dtype=float)
+        if len(samples) == 0:
+            return self.get_angles()
+        # Time steps and unit conversion are done for the whole block at once
+        timestamps = samples[:, 0]
+        previous = timestamps[0] if self.last_timestamp is None else self.last_timestamp
+        steps = np.diff(timestamps, prepend=previous)
+        steps = np.where((steps < 0) | (steps > self.max_dt), self.default_dt, steps)
+        rows = np.column_stack((samples[:, 1:4], np.radians(samples[:, 4:7]), steps))
+
+        state = (*self.quaternion, *self.integral_error)
+        kp = self.proportional_gain
+        ki = self.integral_gain
+        for ax, ay, az, gx, gy, gz, dt in rows.tolist():
+            state = mahony_step(*state, ax, ay, az, gx, gy, gz, dt, kp, ki)
+
+        self.quaternion = list(state[:4])
+        self.integral_error = list(state[4:])
+        self.last_timestamp = timestamps[-1]
+        self.samples += len(samples)
+        self.sample_time += float(steps.sum())
+        self.busy_time += time.perf_counter() - start
+        return self.get_angles()
+
+    def get_angles(self) -> tuple:
+        """Return (pitch, roll, yaw) in degrees."""
+        qw, qx, qy, qz = self.quaternion
+        pitch = math.asin(max(-1.0, min(1.0, -2 * qx * qz + 2 * qw * qy)))
+        roll = math.atan2(2 * qy * qz + 2 * qw * qx, -2 * qx * qx - 2 * qy * qy + 1)
+        yaw = math.atan2(2 * (qx * qy + qw * qz), qw * qw + qx * qx - qy * qy - qz * qz)
+        return math.degrees(pitch), math.degrees(roll), math.degrees(yaw)
+
+    def get_stats(self) -> dict:
+        """Return sample counts and rates: throughput is samples per second of filter time, sample_rate per second of sensor time."""
+        return {
+            'samples': self.samples,
+            'throughput': self.samples / self.busy_time if self.busy_time else 0.0,
+            'sample_rate': self.samples / self.sample_time if self.sample_time else 0.0,
+        }
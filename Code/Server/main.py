@@ -1,6 +1,7 @@
 # -*- coding: utf-8 -*-
 import os
 import sys,getopt
+import asyncio
 import threading
 import Thread
 from ui_server import Ui_server
@@ -10,14 +11,19 @@ from PyQt5.QtWidgets import QApplication, QMainWindow
 from server import Server
 import uvicorn
 from rest_api import app, set_server
+from async_server import AsyncServer
 
 class MyWindow(QMainWindow,Ui_server):
     def __init__(self):
         self.user_ui=True
         self.start_tcp=False
+        self.use_asyncio=False
         self.server=Server()
         self.rest_api_thread=None
         self.parseOpt()
+        if self.use_asyncio:
+            # All ports are served by one event loop, see run_async()
+            return
         # Initialize REST API server
         set_server(self.server)
         self.start_rest_api()
@@ -46,14 +52,22 @@ class MyWindow(QMainWindow,Ui_server):
         self.rest_api_thread.start()
         print("REST API server started on http://0.0.0.0:8000")
 
+    def run_async(self):
+        """Serve the command, video and REST ports from a single asyncio event loop"""
+        asyncio.run(AsyncServer(self.server).serve())
+
     def parseOpt(self):
-        self.opts,self.args = getopt.getopt(sys.argv[1:],"tn")
+        self.opts,self.args = getopt.getopt(sys.argv[1:],"tna")
         for o,a in self.opts:
             if o in ('-t'):
                 print ("Open TCP")
                 self.start_tcp=True
             elif o in ('-n'):
                 self.user_ui=False
+            elif o in ('-a'):
+                print ("Open asyncio server")
+                self.use_asyncio=True
+                self.user_ui=False
                 
     def on_and_off_server(self):
         if self.pushButton_On_And_Off.text() == 'On':
@@ -97,7 +111,9 @@ class MyWindow(QMainWindow,Ui_server):
 if __name__ == '__main__':
     try:
         myshow=MyWindow()
-        if myshow.user_ui==True:
+        if myshow.use_asyncio:
+            myshow.run_async()
+        elif myshow.user_ui==True:
             myshow.show();   
             sys.exit(myshow.app.exec_())
         else:
@@ -23,12 +23,17 @@ class PCA9685:
     __ALLLED_ON_H        = 0xFB
     __ALLLED_OFF_L       = 0xFC
     __ALLLED_OFF_H       = 0xFD
+    __MODE1_AI           = 0x20    # Register auto-increment
+    __BLOCK_CHANNELS     = 8       # SMBus block writes carry at most 32 bytes (8 channels)
 
     def __init__(self, address: int = 0x40, debug: bool = False):
         self.bus = smbus.SMBus(1)
         self.address = address
         self.debug = debug
-        self.write(self.__MODE1, 0x00)
+        self.shadow = [None] * 16    # Last (on, off) ticks written to each channel
+        self.pwm_writes = 0          # Channels actually transmitted
+        self.skipped_writes = 0      # Channels skipped because the ticks were unchanged
+        self.write(self.__MODE1, self.__MODE1_AI)
     
     def write(self, reg: int, value: int) -> None:
         """Writes an 8-bit value to the specified register/address."""
@@ -54,14 +59,52 @@ class PCA9685:
         self.write(self.__MODE1, oldmode)
         time.sleep(0.005)
         self.write(self.__MODE1, oldmode | 0x80)
+        self.invalidate()
+
+    def invalidate(self) -> None:
+        """Forget the shadow registers so the next update of every channel is transmitted."""
+        self.shadow = [None] * 16
 
 
     def set_pwm(self, channel: int, on: int, off: int) -> None:
-        """Sets a single PWM channel."""
-        self.write(self.__LED0_ON_L + 4 * channel, on & 0xFF)
-        self.write(self.__LED0_ON_H + 4 * channel, on >> 8)
-        self.write(self.__LED0_OFF_L + 4 * channel, off & 0xFF)
-        self.write(self.__LED0_OFF_H + 4 * channel, off >> 8)
+        """Sets a single PWM channel, skipping the write if the ticks are unchanged."""
+        if self.shadow[channel] == (on, off):
+            self.skipped_writes += 1
+            return
+        self.bus.write_i2c_block_data(self.address, self.__LED0_ON_L + 4 * channel,
+                                      [on & 0xFF, on >> 8, off & 0xFF, off >> 8])
+        self.shadow[channel] = (on, off)
+        self.pwm_writes += 1
+
+    def set_pwm_block(self, channel: int, values: list) -> None:
+        """Sets consecutive PWM channels starting at channel from a list of (on, off) pairs.
+
+        Only channels whose ticks differ from the shadow registers are sent; each
+        run of changed channels goes out in as few block transfers as possible.
+        """
+        run_start = None
+        for offset, value in enumerate(values):
+            if self.shadow[channel + offset] == tuple(value):
+                self.skipped_writes += 1
+                if run_start is not None:
+                    self._write_block(channel + run_start, values[run_start:offset])
+                    run_start = None
+            elif run_start is None:
+                run_start = offset
+        if run_start is not None:
+            self._write_block(channel + run_start, values[run_start:])
+
+    def _write_block(self, channel: int, values: list) -> None:
+        """Transmits consecutive channels in 32-byte block writes and updates the shadow."""
+        for start in range(0, len(values), self.__BLOCK_CHANNELS):
+            data = []
+            for on, off in values[start:start + self.__BLOCK_CHANNELS]:
+                data += [on & 0xFF, on >> 8, off & 0xFF, off >> 8]
+            self.bus.write_i2c_block_data(self.address, self.__LED0_ON_L + 4 * (channel + start), data)
+        for offset, (on, off) in enumerate(values):
+            self.shadow[channel + offset] = (on, off)
+        self.pwm_writes += len(values)
+
     def set_motor_pwm(self, channel: int, duty: int) -> None:
         """Sets the PWM duty cycle for a motor."""
         self.set_pwm(channel, 0, duty)
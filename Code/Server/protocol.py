@@ -0,0 +1,71 @@
+# -*- coding: utf-8 -*-
+"""
+Stream framing for the port 5002 command channel.
+
+Two encodings share the socket:
+- Text lines, e.g. b'CMD_MOVE#1#0#25#10#0\n' (the original protocol).
+- Binary frames for high-rate commands: MAGIC, opcode, payload length, then a
+  fixed little-endian payload. A client switches to them only after the
+  server answered CMD_PROTOCOL#1, so older servers keep working.
+"""
+import struct
+from command import COMMAND as cmd, Command, parse_command
+
+PROTOCOL_VERSION = 1
+MAGIC = 0xA5                    # Never the first byte of a UTF-8 text command
+HEADER = struct.Struct('<BBB')  # magic, opcode, payload length
+MAX_LINE_LENGTH = 1024          # Discard text without a newline beyond this size
+
+# Opcode -> (command name, payload layout)
+BINARY_COMMANDS = {
+    0x01: (cmd.CMD_MOVE, struct.Struct('<bbbbb')),      # gait, x, y, speed, angle
+    0x02: (cmd.CMD_ATTITUDE, struct.Struct('<bbb')),    # roll, pitch, yaw
+    0x03: (cmd.CMD_POSITION, struct.Struct('<bbb')),    # x, y, z
+    0x04: (cmd.CMD_HEAD, struct.Struct('<Bh')),         # servo channel, angle
+}
+BINARY_OPCODES = {name: (opcode, layout) for opcode, (name, layout) in BINARY_COMMANDS.items()}
+
+
+def encode_command(command: Command) -> bytes:
+    """Encode a command as a binary frame, or as a text line if it has no opcode."""
+    if command.name in BINARY_OPCODES:
+        opcode, layout = BINARY_OPCODES[command.name]
+        return HEADER.pack(MAGIC, opcode, layout.size) + layout.pack(*command.args)
+    return ('#'.join(command.to_parts()) + '\n').encode('utf-8')
+
+
+class StreamReassembler:
+    """Rebuilds whole commands from TCP chunks that may split or merge messages."""
+
+    def __init__(self):
+        self.buffer = bytearray()
+
+    def feed(self, data: bytes) -> list:
+        """Append received bytes and return every complete Command they finish."""
+        self.buffer += data
+        commands = []
+        while self.buffer:
+            if self.buffer[0] == MAGIC:
+                if len(self.buffer) < HEADER.size:
+                    break
+                _, opcode, length = HEADER.unpack_from(self.buffer)
+                if len(self.buffer) < HEADER.size + length:
+                    break
+                payload = bytes(self.buffer[HEADER.size:HEADER.size + length])
+                del self.buffer[:HEADER.size + length]
+                if opcode in BINARY_COMMANDS:
+                    name, layout = BINARY_COMMANDS[opcode]
+                    if layout.size == length:
+                        commands.append(Command(name, layout.unpack(payload)))
+            else:
+                end = self.buffer.find(b'\n')
+                if end < 0:
+                    if len(self.buffer) > MAX_LINE_LENGTH:
+                        self.buffer.clear()
+                    break
+                line = bytes(self.buffer[:end]).decode('utf-8', errors='ignore')
+                del self.buffer[:end + 1]
+                command = parse_command(line)
+                if command is not None:
+                    commands.append(command)
+        return commands
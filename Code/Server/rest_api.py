@@ -3,7 +3,7 @@
 REST API server for robot control
 Provides HTTP endpoints to control the hexapod robot
 """
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Query, WebSocket, WebSocketDisconnect
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel, Field
 from typing import Optional, List, Union, Literal
@@ -16,7 +16,7 @@ try:
 except ImportError:
     HTTPX_AVAILABLE = False
 from server import Server
-from command import COMMAND as cmd
+from command import COMMAND as cmd, Command as ParsedCommand
 
 app = FastAPI(title="Hexapod Robot Control API", version="1.0.0")
 
@@ -39,106 +39,164 @@ def set_server(server: Server):
     robot_server = server
 
 
-def process_command(command_parts: list):
+def _handle_buzzer(command: ParsedCommand):
+    robot_server.buzzer_controller.set_state(command.args[0] == 1)
+
+
+def _handle_power(command: ParsedCommand, max_age: Optional[float] = None):
+    try:
+        # Served from the sensor cache; the ADC is only read when the cached sample is too old
+        battery_voltage, timestamp = robot_server.telemetry.read("power", max_age)
+        return {
+            "command": cmd.CMD_POWER,
+            "load_battery": battery_voltage[0],
+            "raspberry_pi_battery": battery_voltage[1],
+            "timestamp": timestamp,
+            "age": round(time.time() - timestamp, 3)
+        }
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Failed to read battery voltage: {str(e)}")
+
+
+def _handle_led(command: ParsedCommand):
+    try:
+        if robot_server.led_thread is not None:
+            from Thread import stop_thread
+            stop_thread(robot_server.led_thread)
+    except:
+        pass
+    robot_server.led_thread = threading.Thread(
+        target=robot_server.led_controller.process_light_command,
+        args=(command.to_parts(),)
+    )
+    robot_server.led_thread.start()
+
+
+def _handle_sonic(command: ParsedCommand, max_age: Optional[float] = None):
+    distance, timestamp = robot_server.telemetry.read("sonic", max_age)
+    if distance is None:
+        raise HTTPException(status_code=503, detail="No ultrasonic reading available")
+    return {
+        "command": cmd.CMD_SONIC,
+        "distance": distance,
+        "timestamp": timestamp,
+        "age": round(time.time() - timestamp, 3)
+    }
+
+
+def _handle_head(command: ParsedCommand):
+    # Fix: Swap servo ID 0 and 1 because they are reversed physically
+    # Input: 0=Horizontal, 1=Vertical
+    # Hardware: 0=Vertical, 1=Horizontal (based on user report)
+    req_id = command.args[0]
+    target_id = 1 - req_id if req_id in [0, 1] else req_id
+    robot_server.servo_controller.set_servo_angle(target_id, command.args[1])
+
+
+def _handle_camera(command: ParsedCommand):
+    x = robot_server.control_system.restrict_value(command.args[0], 50, 180)
+    y = robot_server.control_system.restrict_value(command.args[1], 0, 180)
+    # Fix: Swap servo ID 0 and 1
+    # x is Horizontal -> should map to Hardware ID 1
+    # y is Vertical -> should map to Hardware ID 0
+    robot_server.servo_controller.set_servo_angle(1, x)
+    robot_server.servo_controller.set_servo_angle(0, y)
+
+
+def _handle_relax(command: ParsedCommand):
+    if robot_server.is_servo_relaxed == False:
+        robot_server.control_system.relax(True)
+        robot_server.is_servo_relaxed = True
+    else:
+        robot_server.control_system.relax(False)
+        robot_server.is_servo_relaxed = False
+
+
+def _handle_servo_power(command: ParsedCommand):
+    if command.args[0] == 0:
+        robot_server.control_system.servo_power_disable.on()
+    else:
+        robot_server.control_system.servo_power_disable.off()
+
+
+def _handle_video(command: ParsedCommand):
+    robot_server.handle_video(command)
+
+
+# Commands handled directly by the API; everything else goes to the control thread
+COMMAND_HANDLERS = {
+    cmd.CMD_BUZZER: _handle_buzzer,
+    cmd.CMD_POWER: _handle_power,
+    cmd.CMD_LED: _handle_led,
+    cmd.CMD_LED_MOD: _handle_led,
+    cmd.CMD_SONIC: _handle_sonic,
+    cmd.CMD_HEAD: _handle_head,
+    cmd.CMD_CAMERA: _handle_camera,
+    cmd.CMD_RELAX: _handle_relax,
+    cmd.CMD_SERVOPOWER: _handle_servo_power,
+    cmd.CMD_VIDEO: _handle_video,
+}
+
+
+def process_command(command: Union[ParsedCommand, list]):
     """
     명령을 처리하는 내부 함수
     
     REST API 요청을 기존 TCP 서버의 명령 처리 로직으로 변환하여 실행합니다.
-    각 명령 타입에 따라 적절한 하드웨어 제어 함수를 호출합니다.
+    명령 이름으로 COMMAND_HANDLERS 테이블에서 처리 함수를 찾아 호출하며,
+    테이블에 없는 명령은 제어 스레드로 전달됩니다.
     
     Args:
-        command_parts: 명령 문자열 리스트. 첫 번째 요소는 명령 타입(CMD_*),
-                      이후 요소들은 명령에 필요한 파라미터들입니다.
+        command: ParsedCommand 객체 또는 명령 문자열 리스트. 리스트인 경우 첫 번째 요소는
+                 명령 타입(CMD_*), 이후 요소들은 명령에 필요한 파라미터들입니다.
     
     Returns:
         dict: 명령 처리 결과를 포함한 딕셔너리.
               일부 명령(CMD_POWER, CMD_SONIC)은 추가 정보를 반환합니다.
     
     Raises:
-        HTTPException: 로봇 서버가 초기화되지 않았거나 명령 처리 중 오류가 발생한 경우.
+        HTTPException: 로봇 서버가 초기화되지 않았거나, 명령 형식이 잘못되었거나,
+                       명령 처리 중 오류가 발생한 경우.
     """
     if robot_server is None:
         raise HTTPException(status_code=503, detail="Robot server not initialized")
     
-    if cmd.CMD_BUZZER in command_parts:
-        robot_server.buzzer_controller.set_state(command_parts[1] == "1")
-    elif cmd.CMD_POWER in command_parts:
-        try:
-            battery_voltage = robot_server.adc_sensor.read_battery_voltage()
-            return {
-                "command": cmd.CMD_POWER,
-                "load_battery": battery_voltage[0],
-                "raspberry_pi_battery": battery_voltage[1]
-            }
-        except Exception as e:
-            raise HTTPException(status_code=500, detail=f"Failed to read battery voltage: {str(e)}")
-    elif cmd.CMD_LED in command_parts:
-        try:
-            if robot_server.led_thread is not None:
-                from Thread import stop_thread
-                stop_thread(robot_server.led_thread)
-        except:
-            pass
-        robot_server.led_thread = threading.Thread(
-            target=robot_server.led_controller.process_light_command,
-            args=(command_parts,)
-        )
-        robot_server.led_thread.start()
-    elif cmd.CMD_LED_MOD in command_parts:
-        try:
-            if robot_server.led_thread is not None:
-                from Thread import stop_thread
-                stop_thread(robot_server.led_thread)
-        except:
-            pass
-        robot_server.led_thread = threading.Thread(
-            target=robot_server.led_controller.process_light_command,
-            args=(command_parts,)
-        )
-        robot_server.led_thread.start()
-    elif cmd.CMD_SONIC in command_parts:
-        distance = robot_server.ultrasonic_sensor.get_distance()
-        return {
-            "command": cmd.CMD_SONIC,
-            "distance": distance
-        }
-    elif cmd.CMD_HEAD in command_parts:
-        if len(command_parts) == 3:
-            # Fix: Swap servo ID 0 and 1 because they are reversed physically
-            # Input: 0=Horizontal, 1=Vertical
-            # Hardware: 0=Vertical, 1=Horizontal (based on user report)
-            req_id = int(command_parts[1])
-            target_id = 1 - req_id if req_id in [0, 1] else req_id
-            robot_server.servo_controller.set_servo_angle(
-                target_id, int(command_parts[2])
-            )
-    elif cmd.CMD_CAMERA in command_parts:
-        if len(command_parts) == 3:
-            x = robot_server.control_system.restrict_value(int(command_parts[1]), 50, 180)
-            y = robot_server.control_system.restrict_value(int(command_parts[2]), 0, 180)
-            # Fix: Swap servo ID 0 and 1
-            # x is Horizontal -> should map to Hardware ID 1
-            # y is Vertical -> should map to Hardware ID 0
-            robot_server.servo_controller.set_servo_angle(1, x)
-            robot_server.servo_controller.set_servo_angle(0, y)
-    elif cmd.CMD_RELAX in command_parts:
-        if robot_server.is_servo_relaxed == False:
-            robot_server.control_system.relax(True)
-            robot_server.is_servo_relaxed = True
-        else:
-            robot_server.control_system.relax(False)
-            robot_server.is_servo_relaxed = False
-    elif cmd.CMD_SERVOPOWER in command_parts:
-        if command_parts[1] == "0":
-            robot_server.control_system.servo_power_disable.on()
-        else:
-            robot_server.control_system.servo_power_disable.off()
-    else:
-        import time
-        robot_server.control_system.command_queue = command_parts
-        robot_server.control_system.timeout = time.time()
+    if not isinstance(command, ParsedCommand):
+        parsed = ParsedCommand.from_parts([str(part) for part in command])
+        if parsed is None:
+            raise HTTPException(status_code=400, detail=f"Invalid command: {'#'.join(map(str, command))}")
+        command = parsed
     
-    return {"status": "success", "command": command_parts[0]}
+    handler = COMMAND_HANDLERS.get(command.name)
+    if handler is None:
+        robot_server.control_system.submit_command(command)
+    else:
+        result = handler(command)
+        if result is not None:
+            return result
+
+    return {"status": "success", "command": command.name}
+
+
+async def run_command(command: Union[ParsedCommand, list]):
+    """
+    process_command를 하드웨어 전용 스레드 풀에서 실행합니다.
+
+    I2C/GPIO 호출이 이벤트 루프를 막지 않도록 하여, 같은 루프에서 동작하는
+    TCP 명령/영상 포트와 다른 REST 요청이 계속 처리되게 합니다.
+    """
+    if robot_server is None:
+        raise HTTPException(status_code=503, detail="Robot server not initialized")
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(robot_server.hardware_executor, process_command, command)
+
+
+async def _read_sensor(handler, command: ParsedCommand, max_age: Optional[float]):
+    """센서 캐시 조회. 캐시가 max_age보다 오래된 경우에만 하드웨어를 읽으므로 스레드 풀에서 실행합니다."""
+    if robot_server is None:
+        raise HTTPException(status_code=503, detail="Robot server not initialized")
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(robot_server.hardware_executor, handler, command, max_age)
 
 
 # Request models
@@ -387,6 +445,12 @@ class ServoPowerRequest(BaseModel):
     power_on: bool = Field(..., description="Servo power: true=on, false=off")
 
 
+class VideoRequest(BaseModel):
+    format: Literal["mjpeg", "h264"] = Field(..., description="Video stream encoding on port 8002")
+    bitrate_kbps: int = Field(1000, ge=100, le=10000, description="H.264 target bitrate in kbit/s")
+    keyframe_interval: int = Field(30, ge=1, le=300, description="H.264 frames between keyframes")
+
+
 # Sequential Command Models
 class MoveCommandParams(BaseModel):
     mode: int = Field(..., ge=1, le=2)
@@ -602,15 +666,14 @@ async def move(request: MoveRequest):
             "angle": 0
         }
     """
-    command_parts = [
-        cmd.CMD_MOVE,
-        str(request.mode),
-        str(-request.y),
-        str(request.x),
-        str(request.speed),
-        str(request.angle)
-    ]
-    return process_command(command_parts)
+    command = ParsedCommand(cmd.CMD_MOVE, (
+        request.mode,
+        -request.y,
+        request.x,
+        request.speed,
+        request.angle
+    ))
+    return await run_command(command)
 
 
 @app.post("/api/led")
@@ -631,52 +694,42 @@ async def set_led(request: LEDRequest):
     Note:
         LED 모드를 먼저 설정하지 않으면 색상이 적용되지 않을 수 있습니다.
     """
-    command_parts = [
-        cmd.CMD_LED,
-        str(request.r),
-        str(request.g),
-        str(request.b)
-    ]
-    return process_command(command_parts)
+    command = ParsedCommand(cmd.CMD_LED, (request.r, request.g, request.b))
+    return await run_command(command)
 
 
 @app.post("/api/led/mode")
 async def set_led_mode(request: LEDModeRequest):
     """Set LED mode"""
-    command_parts = [cmd.CMD_LED_MOD, str(request.mode)]
-    return process_command(command_parts)
+    command = ParsedCommand(cmd.CMD_LED_MOD, (request.mode,))
+    return await run_command(command)
 
 
 @app.get("/api/ultrasonic")
-async def get_ultrasonic():
-    """Get ultrasonic distance measurement"""
-    command_parts = [cmd.CMD_SONIC]
-    return process_command(command_parts)
+async def get_ultrasonic(max_age: Optional[float] = Query(None, ge=0, description="Oldest acceptable cached reading in seconds")):
+    """Get the cached ultrasonic distance and the time it was measured"""
+    return await _read_sensor(_handle_sonic, ParsedCommand(cmd.CMD_SONIC), max_age)
 
 
 @app.post("/api/buzzer")
 async def set_buzzer(request: BuzzerRequest):
     """Control buzzer"""
-    command_parts = [cmd.CMD_BUZZER, "1" if request.state else "0"]
-    return process_command(command_parts)
+    command = ParsedCommand(cmd.CMD_BUZZER, (1 if request.state else 0,))
+    return await run_command(command)
 
 
 @app.post("/api/head")
 async def set_head(request: HeadRequest):
     """Control head servos"""
-    command_parts = [
-        cmd.CMD_HEAD,
-        str(request.servo_id),
-        str(request.angle)
-    ]
-    return process_command(command_parts)
+    command = ParsedCommand(cmd.CMD_HEAD, (request.servo_id, request.angle))
+    return await run_command(command)
 
 
 @app.post("/api/balance")
 async def set_balance(request: BalanceRequest):
     """Enable/disable balance function"""
-    command_parts = [cmd.CMD_BALANCE, "1" if request.enable else "0"]
-    return process_command(command_parts)
+    command = ParsedCommand(cmd.CMD_BALANCE, (1 if request.enable else 0,))
+    return await run_command(command)
 
 
 @app.post("/api/attitude")
@@ -698,13 +751,8 @@ async def set_attitude(request: AttitudeRequest):
         각도 범위는 -15도에서 15도로 제한되어 있습니다.
         이 범위를 벗어나면 로봇이 불안정해질 수 있습니다.
     """
-    command_parts = [
-        cmd.CMD_ATTITUDE,
-        str(request.roll),
-        str(request.pitch),
-        str(request.yaw)
-    ]
-    return process_command(command_parts)
+    command = ParsedCommand(cmd.CMD_ATTITUDE, (request.roll, request.pitch, request.yaw))
+    return await run_command(command)
 
 
 @app.post("/api/position")
@@ -726,45 +774,85 @@ async def set_position(request: PositionRequest):
         이 명령은 로봇의 자세를 변경하지 않고 위치만 이동시킵니다.
         몸체를 높이거나 낮추려면 z 값을 조정하세요.
     """
-    command_parts = [
-        cmd.CMD_POSITION,
-        str(-request.y),
-        str(request.x),
-        str(request.z)
-    ]
-    return process_command(command_parts)
+    command = ParsedCommand(cmd.CMD_POSITION, (-request.y, request.x, request.z))
+    return await run_command(command)
 
 
 @app.post("/api/camera")
 async def set_camera(request: CameraRequest):
     """Control camera view"""
-    command_parts = [
-        cmd.CMD_CAMERA,
-        str(request.x),
-        str(request.y)
-    ]
-    return process_command(command_parts)
+    command = ParsedCommand(cmd.CMD_CAMERA, (request.x, request.y))
+    return await run_command(command)
 
 
 @app.post("/api/relax")
 async def toggle_relax():
     """Toggle servo relax state"""
-    command_parts = [cmd.CMD_RELAX]
-    return process_command(command_parts)
+    command = ParsedCommand(cmd.CMD_RELAX)
+    return await run_command(command)
 
 
 @app.get("/api/power")
-async def get_power():
-    """Get battery voltage"""
-    command_parts = [cmd.CMD_POWER]
-    return process_command(command_parts)
+async def get_power(max_age: Optional[float] = Query(None, ge=0, description="Oldest acceptable cached reading in seconds")):
+    """Get the cached battery voltage and the time it was measured"""
+    return await _read_sensor(_handle_power, ParsedCommand(cmd.CMD_POWER), max_age)
 
 
 @app.post("/api/servo/power")
 async def set_servo_power(request: ServoPowerRequest):
     """Control servo power"""
-    command_parts = [cmd.CMD_SERVOPOWER, "1" if request.power_on else "0"]
-    return process_command(command_parts)
+    command = ParsedCommand(cmd.CMD_SERVOPOWER, (1 if request.power_on else 0,))
+    return await run_command(command)
+
+
+@app.post("/api/video")
+async def set_video(request: VideoRequest):
+    """Select MJPEG or H.264 streaming for all video viewers"""
+    command = ParsedCommand(cmd.CMD_VIDEO, (1 if request.format == "h264" else 0, request.bitrate_kbps, request.keyframe_interval))
+    return await run_command(command)
+
+
+def _telemetry_json(name: str, value, timestamp: float) -> dict:
+    if name == "power":
+        value = {"load_battery": value[0], "raspberry_pi_battery": value[1]}
+    elif name == "imu":
+        value = {"pitch": value[0], "roll": value[1], "yaw": value[2]}
+    return {"sensor": name, "value": value, "timestamp": timestamp}
+
+
+@app.get("/api/telemetry")
+async def get_telemetry():
+    """Get the latest sampled battery, ultrasonic and IMU values without touching the hardware"""
+    if robot_server is None:
+        raise HTTPException(status_code=503, detail="Robot server not initialized")
+    snapshot = robot_server.telemetry.get_snapshot()
+    return {name: _telemetry_json(name, value, timestamp) for name, (value, timestamp) in snapshot.items()}
+
+
+@app.websocket("/ws/telemetry")
+async def telemetry_stream(websocket: WebSocket):
+    """Push every telemetry sample to the client as JSON as soon as it is taken"""
+    await websocket.accept()
+    if robot_server is None:
+        await websocket.close(code=1011)
+        return
+    loop = asyncio.get_running_loop()
+    updates = asyncio.Queue(maxsize=100)
+
+    def push(name, value, timestamp):
+        # Called on the telemetry thread; a client that stops reading loses updates, not memory
+        loop.call_soon_threadsafe(lambda: updates.full() or updates.put_nowait(_telemetry_json(name, value, timestamp)))
+
+    subscription = robot_server.telemetry.subscribe(push)
+    try:
+        for name, (value, timestamp) in robot_server.telemetry.get_snapshot().items():
+            await websocket.send_json(_telemetry_json(name, value, timestamp))
+        while True:
+            await websocket.send_json(await updates.get())
+    except WebSocketDisconnect:
+        pass
+    finally:
+        robot_server.telemetry.unsubscribe(subscription)
 
 
 @app.get("/api/status")
@@ -795,24 +883,19 @@ async def execute_command(command: Command) -> dict:
     
     try:
         if isinstance(command, MoveCommand):
-            command_parts = [
-                cmd.CMD_MOVE,
-                str(command.params.mode),
-                str(-command.params.y),
-                str(command.params.x),
-                str(command.params.speed),
-                str(command.params.angle)
-            ]
-            result = process_command(command_parts)
+            robot_command = ParsedCommand(cmd.CMD_MOVE, (
+                command.params.mode,
+                -command.params.y,
+                command.params.x,
+                command.params.speed,
+                command.params.angle
+            ))
+            result = await run_command(robot_command)
             return {"id": command.id, "status": "success", "command": "move", **result}
         
         elif isinstance(command, HeadCommand):
-            command_parts = [
-                cmd.CMD_HEAD,
-                str(command.params.servo_id),
-                str(command.params.angle)
-            ]
-            result = process_command(command_parts)
+            robot_command = ParsedCommand(cmd.CMD_HEAD, (command.params.servo_id, command.params.angle))
+            result = await run_command(robot_command)
             return {"id": command.id, "status": "success", "command": "head", **result}
         
         elif isinstance(command, WaitCommand):
@@ -839,62 +922,51 @@ async def execute_command(command: Command) -> dict:
             }
         
         elif isinstance(command, LEDCommand):
-            command_parts = [
-                cmd.CMD_LED,
-                str(command.params.r),
-                str(command.params.g),
-                str(command.params.b)
-            ]
-            result = process_command(command_parts)
+            robot_command = ParsedCommand(cmd.CMD_LED, (command.params.r, command.params.g, command.params.b))
+            result = await run_command(robot_command)
             return {"id": command.id, "status": "success", "command": "led", **result}
         
         elif isinstance(command, LEDModeCommand):
-            command_parts = [cmd.CMD_LED_MOD, str(command.params.mode)]
-            result = process_command(command_parts)
+            robot_command = ParsedCommand(cmd.CMD_LED_MOD, (command.params.mode,))
+            result = await run_command(robot_command)
             return {"id": command.id, "status": "success", "command": "led_mode", **result}
         
         elif isinstance(command, BuzzerCommand):
-            command_parts = [cmd.CMD_BUZZER, "1" if command.params.state else "0"]
-            result = process_command(command_parts)
+            robot_command = ParsedCommand(cmd.CMD_BUZZER, (1 if command.params.state else 0,))
+            result = await run_command(robot_command)
             return {"id": command.id, "status": "success", "command": "buzzer", **result}
         
         elif isinstance(command, AttitudeCommand):
-            command_parts = [
-                cmd.CMD_ATTITUDE,
-                str(command.params.roll),
-                str(command.params.pitch),
-                str(command.params.yaw)
-            ]
-            result = process_command(command_parts)
+            robot_command = ParsedCommand(cmd.CMD_ATTITUDE, (
+                command.params.roll,
+                command.params.pitch,
+                command.params.yaw
+            ))
+            result = await run_command(robot_command)
             return {"id": command.id, "status": "success", "command": "attitude", **result}
         
         elif isinstance(command, PositionCommand):
-            command_parts = [
-                cmd.CMD_POSITION,
-                str(-command.params.y),
-                str(command.params.x),
-                str(command.params.z)
-            ]
-            result = process_command(command_parts)
+            robot_command = ParsedCommand(cmd.CMD_POSITION, (
+                -command.params.y,
+                command.params.x,
+                command.params.z
+            ))
+            result = await run_command(robot_command)
             return {"id": command.id, "status": "success", "command": "position", **result}
         
         elif isinstance(command, CameraCommand):
-            command_parts = [
-                cmd.CMD_CAMERA,
-                str(command.params.x),
-                str(command.params.y)
-            ]
-            result = process_command(command_parts)
+            robot_command = ParsedCommand(cmd.CMD_CAMERA, (command.params.x, command.params.y))
+            result = await run_command(robot_command)
             return {"id": command.id, "status": "success", "command": "camera", **result}
         
         elif isinstance(command, BalanceCommand):
-            command_parts = [cmd.CMD_BALANCE, "1" if command.params.enable else "0"]
-            result = process_command(command_parts)
+            robot_command = ParsedCommand(cmd.CMD_BALANCE, (1 if command.params.enable else 0,))
+            result = await run_command(robot_command)
             return {"id": command.id, "status": "success", "command": "balance", **result}
         
         elif isinstance(command, ServoPowerCommand):
-            command_parts = [cmd.CMD_SERVOPOWER, "1" if command.params.power_on else "0"]
-            result = process_command(command_parts)
+            robot_command = ParsedCommand(cmd.CMD_SERVOPOWER, (1 if command.params.power_on else 0,))
+            result = await run_command(robot_command)
             return {"id": command.id, "status": "success", "command": "servo_power", **result}
         
         else:
@@ -0,0 +1,65 @@
+# -*- coding: utf-8 -*-
+import time
+
+
+class LoopScheduler:
+    """
+    Fixed-rate loop pacing on absolute monotonic deadlines.
+
+    Unlike sleeping a fixed delay after each frame, the period does not grow
+    with the work done per frame. When the loop falls behind by whole periods,
+    wait() reports how many ticks were missed so the caller can skip frames
+    instead of slowing down.
+    """
+
+    def __init__(self, period: float):
+        self.period = period
+        self.next_tick = None
+        self.reset_stats()
+
+    def reset_stats(self) -> None:
+        """Clear the timing statistics."""
+        self.ticks = 0
+        self.overruns = 0
+        self.missed_ticks = 0
+        self.jitter_sum = 0.0
+        self.max_jitter = 0.0
+
+    def start(self) -> None:
+        """Begin a new run; the first deadline is one period from now."""
+        self.next_tick = time.monotonic() + self.period
+
+    def wait(self) -> int:
+        """
+        Sleep until the next deadline.
+
+        :return: Number of whole periods that were missed (0 when on time).
+        """
+        if self.next_tick is None:
+            self.start()
+        now = time.monotonic()
+        missed = 0
+        if now < self.next_tick:
+            time.sleep(self.next_tick - now)
+        else:
+            self.overruns += 1
+            missed = int((now - self.next_tick) / self.period)
+            self.next_tick += missed * self.period
+            self.missed_ticks += missed
+        jitter = time.monotonic() - self.next_tick
+        self.jitter_sum += jitter
+        self.max_jitter = max(self.max_jitter, jitter)
+        self.ticks += 1
+        self.next_tick += self.period
+        return missed
+
+    def get_stats(self) -> dict:
+        """Return tick, overrun and jitter statistics (jitter in seconds)."""
+        return {
+            'period': self.period,
+            'ticks': self.ticks,
+            'overruns': self.overruns,
+            'missed_ticks': self.missed_ticks,
+            'mean_jitter': self.jitter_sum / self.ticks if self.ticks else 0.0,
+            'max_jitter': self.max_jitter,
+        }
@@ -6,6 +6,7 @@ import socket
 import struct
 from threading import Condition
 import threading
+from concurrent.futures import ThreadPoolExecutor
 from led import Led
 from servo import Servo
 from Thread import stop_thread
@@ -14,6 +15,9 @@ from control import Control
 from adc import ADC
 from ultrasonic import Ultrasonic
 from command import COMMAND as cmd
+from protocol import PROTOCOL_VERSION, StreamReassembler
+from video_quality import VideoQualityController, unsent_bytes
+from telemetry import Telemetry, TelemetrySender, telemetry_message
 from camera import Camera  
 
 class StreamingOutput(io.BufferedIOBase):
@@ -38,10 +42,37 @@ class Server:
         self.buzzer_controller = Buzzer()
         self.control_system = Control()
         self.ultrasonic_sensor = Ultrasonic()
+        self.ultrasonic_sensor.start_ranging()  # Filtered distance is kept current in the background
         self.camera_device = Camera()  
         self.led_thread = None 
         self.ultrasonic_thread = None  
+        self.video_connections = []  # Open viewer sockets on port 8002
+        self.video_quality = VideoQualityController()  # Shared by all viewers, follows the slowest
+        # Sensors are sampled on their own schedule; handlers and subscribers read the snapshot
+        self.telemetry = Telemetry(self.adc_sensor, self.ultrasonic_sensor, self.control_system.imu)
+        self.telemetry_subscription = None
+        self.telemetry_sender = None
+        # Telemetry pushes and command responses share the command socket from different threads
+        self.send_lock = threading.Lock()
+        # Bounded pool for blocking hardware calls made from asyncio code
+        self.hardware_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix='hardware')
+        # Commands handled directly by the server; everything else goes to the control thread
+        self.command_handlers = {
+            cmd.CMD_BUZZER: self.handle_buzzer,
+            cmd.CMD_POWER: self.handle_power,
+            cmd.CMD_LED: self.handle_led,
+            cmd.CMD_LED_MOD: self.handle_led,
+            cmd.CMD_SONIC: self.handle_sonic,
+            cmd.CMD_HEAD: self.handle_head,
+            cmd.CMD_CAMERA: self.handle_camera,
+            cmd.CMD_RELAX: self.handle_relax,
+            cmd.CMD_SERVOPOWER: self.handle_servo_power,
+            cmd.CMD_PROTOCOL: self.handle_protocol,
+            cmd.CMD_VIDEO: self.handle_video,
+            cmd.CMD_TELEMETRY: self.handle_telemetry,
+        }
         self.control_system.condition_thread.start()
+        self.telemetry.start()
 
     def get_interface_ip(self):
         # Get the IP address of the wlan0 interface
@@ -57,7 +88,7 @@ class Server:
         self.video_socket = socket.socket()
         self.video_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
         self.video_socket.bind((host_ip, 8002))
-        self.video_socket.listen(1)
+        self.video_socket.listen(4)
         self.command_socket = socket.socket()
         self.command_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
         self.command_socket.bind((host_ip, 5002))
@@ -67,7 +98,15 @@ class Server:
     def stop_server(self):
         # Stop the video and command servers
         try:
-            self.video_connection.close()
+            self.video_socket.close()
+        except:
+            pass
+        for connection in list(self.video_connections):
+            try:
+                connection.shutdown(socket.SHUT_RDWR)
+            except:
+                pass
+        try:
             self.command_connection.close()
         except:
             print('\n' + "No client connection")
@@ -82,36 +121,158 @@ class Server:
         self.command_thread.start()
 
     def send_data(self, connection, data):
-        # Send data over the specified connection
+        # Send data over the specified connection; whole lines only, so concurrent senders never interleave
         try:
-            connection.send(data.encode('utf-8'))
+            with self.send_lock:
+                connection.sendall(data.encode('utf-8'))
             # print("send",data)
         except Exception as e:
             print(e)
 
     def transmit_video(self):
-        # Transmit video frames to the connected client
+        # Accept any number of viewers; each one reads the shared frame ring buffer
+        while True:
+            try:
+                connection, client_address = self.video_socket.accept()
+            except:
+                break
+            print("Video socket connected ... ", client_address)
+            self.video_connections.append(connection)
+            threading.Thread(target=self.serve_video_client, args=(connection,), daemon=True).start()
+        self.video_socket.close()
+
+    def serve_video_client(self, connection):
+        # Send length-prefixed frames to one viewer, skipping to the newest frame when it falls behind
+        cursor = self.camera_device.open_viewer()
+        try:
+            while True:
+                frame = cursor.next_frame(timeout=1.0)
+                if frame is None:
+                    continue
+                try:
+                    self.send_video_frame_adaptive(connection, cursor, frame)
+                finally:
+                    frame.release()
+        except Exception as e:
+            pass
+        finally:
+            self.camera_device.close_viewer(cursor)
+            try:
+                self.video_connections.remove(connection)
+                connection.close()
+            except:
+                pass
+            print("End transmit ... ")
+
+    def send_video_frame_adaptive(self, connection, cursor, frame):
+        # Drop the frame while the previous one is still queued, and adapt the stream to the backlog
+        queued = unsent_bytes(connection)
+        if self.video_quality.should_send(queued, len(frame)):
+            start = time.monotonic()
+            self.send_video_frame(connection, frame)
+            change = self.video_quality.report(queued, len(frame), time.monotonic() - start)
+        else:
+            cursor.need_keyframe = True   # Frames after a gap cannot be decoded, even if the dropped one was the keyframe
+            change = self.video_quality.report(queued, len(frame), 0.0, sent=False)
+        if change is not None:
+            self.camera_device.set_stream_quality(*change)
+
+    def send_video_frame(self, connection, frame):
+        # Send the length header and the frame in one scatter-gather call, without copying the frame
+        buffers = [struct.pack('<I', len(frame)), frame.data]
+        while buffers:
+            sent = connection.sendmsg(buffers)
+            while buffers and sent >= len(buffers[0]):
+                sent -= len(buffers[0])
+                buffers.pop(0)
+            if sent:
+                buffers[0] = buffers[0][sent:]
+
+    def dispatch_command(self, command):
+        """Run a parsed command and return the text response to send back, if any."""
+        handler = self.command_handlers.get(command.name, self.control_system.submit_command)
+        return handler(command)
+
+    def handle_buzzer(self, command):
+        self.buzzer_controller.set_state(command.args[0] == 1)
+
+    def handle_power(self, command):
         try:
-            self.video_connection, self.video_client_address = self.video_socket.accept()
-            self.video_connection = self.video_connection.makefile('wb')
+            battery_voltage, timestamp = self.telemetry.read('power')
+            return cmd.CMD_POWER + "#" + str(battery_voltage[0]) + "#" + str(battery_voltage[1]) + "\n"
+        except:
+            return None
+
+    def handle_led(self, command):
+        try:
+            if self.led_thread is not None:
+                stop_thread(self.led_thread)
         except:
             pass
-        self.video_socket.close()
-        print("Video socket connected ... ")
+        self.led_thread = threading.Thread(target=self.led_controller.process_light_command, args=(command.to_parts(),))
+        self.led_thread.start()
 
-        self.camera_device.start_stream()
-        while True:
-            try:
-                frame = self.camera_device.get_frame() 
-                frame_length = len(frame)
-                # print("output .length:",lenFrame)
-                length_binary = struct.pack('<I', frame_length)
-                self.video_connection.write(length_binary)
-                self.video_connection.write(frame)
-            except Exception as e:
-                self.camera_device.stop_stream()
-                print("End transmit ... ")
-                break
+    def handle_sonic(self, command):
+        distance, timestamp = self.telemetry.read('sonic')
+        return cmd.CMD_SONIC + "#" + str(distance) + "\n"
+
+    def handle_head(self, command):
+        self.servo_controller.set_servo_angle(command.args[0], command.args[1])
+
+    def handle_camera(self, command):
+        x = self.control_system.restrict_value(command.args[0], 50, 180)
+        y = self.control_system.restrict_value(command.args[1], 0, 180)
+        self.servo_controller.set_servo_angle(0, x)
+        self.servo_controller.set_servo_angle(1, y)
+
+    def handle_relax(self, command):
+        if self.is_servo_relaxed == False:
+            self.control_system.relax(True)
+            self.is_servo_relaxed = True
+            print("relax")
+        else:
+            self.control_system.relax(False)
+            self.is_servo_relaxed = False
+            print("unrelax")
+
+    def handle_servo_power(self, command):
+        if command.args[0] == 0:
+            self.control_system.servo_power_disable.on()
+        else:
+            self.control_system.servo_power_disable.off()
+
+    def handle_protocol(self, command):
+        # Acknowledge the highest framing version both sides understand
+        version = min(command.args[0], PROTOCOL_VERSION)
+        return cmd.CMD_PROTOCOL + "#" + str(version) + "\n"
+
+    def handle_video(self, command):
+        # Switch the shared video encoder between MJPEG and H.264
+        if len(command.args) == 3:
+            self.camera_device.set_stream_format(command.args[0], command.args[1] * 1000, command.args[2])
+        else:
+            self.camera_device.set_stream_format(command.args[0])
+
+    def handle_telemetry(self, command):
+        # Push sensor updates to the connected command client instead of waiting to be polled
+        self.stop_telemetry_push()
+        if command.args[0] == 1:
+            connection = self.command_connection
+            # The sampling thread only queues; a client that stops reading cannot stall it
+            self.telemetry_sender = TelemetrySender(lambda message: self.send_data(connection, message))
+            sender = self.telemetry_sender
+            self.telemetry_subscription = self.telemetry.subscribe(
+                lambda name, value, timestamp: sender.push(telemetry_message(name, value)))
+        return cmd.CMD_TELEMETRY + "#" + str(1 if command.args[0] == 1 else 0) + "\n"
+
+    def stop_telemetry_push(self):
+        # Cancel the command client's telemetry subscription and its sender thread
+        if self.telemetry_subscription is not None:
+            self.telemetry.unsubscribe(self.telemetry_subscription)
+            self.telemetry_subscription = None
+        if self.telemetry_sender is not None:
+            self.telemetry_sender.close()
+            self.telemetry_sender = None
 
     def receive_commands(self):
         # Receive and process commands from the connected client
@@ -122,90 +283,26 @@ class Server:
             print("Client connect failed")
         self.command_socket.close()
 
+        reassembler = StreamReassembler()
         while True:
             try:
-                received_data = self.command_connection.recv(1024).decode('utf-8')
+                received_data = self.command_connection.recv(1024)
             except:
                 if self.is_tcp_active:
                     self.reset_server()
                     break
                 else:
                     break
-            if received_data == "" and self.is_tcp_active:
+            if received_data == b"" and self.is_tcp_active:
                 self.reset_server()
                 break
-            else:
-                command_array = received_data.split('\n')
-                print(command_array)
-                if command_array[-1] != "":
-                    command_array = command_array[:-1]  
-            for single_command in command_array:
-                command_parts = single_command.split("#")
-                if command_parts == None or command_parts[0] == '':
-                    continue
-                elif cmd.CMD_BUZZER in command_parts:
-                    self.buzzer_controller.set_state(command_parts[1] == "1")
-                elif cmd.CMD_POWER in command_parts:
-                    try:
-                        battery_voltage = self.adc_sensor.read_battery_voltage()
-                        response_command = cmd.CMD_POWER + "#" + str(battery_voltage[0]) + "#" + str(battery_voltage[1]) + "\n"
-                        # print(command)
-                        self.send_data(self.command_connection, response_command)
-                        # if battery_voltage[0] < 5.5 or battery_voltage[1] < 6:
-                        #     for _ in range(3):
-                        #         self.buzzer_controller.set_state(True)
-                        #         time.sleep(0.15)
-                        #         self.buzzer_controller.set_state(False)
-                        #         time.sleep(0.1)
-                    except:
-                        pass
-                elif cmd.CMD_LED in command_parts:
-                    try:
-                        if self.led_thread is not None:
-                            stop_thread(self.led_thread)
-                    except:
-                        pass
-                    self.led_thread = threading.Thread(target=self.led_controller.process_light_command, args=(command_parts,))
-                    self.led_thread.start()
-
-                elif cmd.CMD_LED_MOD in command_parts:
-                    try:
-                        if self.led_thread is not None:
-                            stop_thread(self.led_thread)
-                    except:
-                        pass
-                    self.led_thread = threading.Thread(target=self.led_controller.process_light_command, args=(command_parts,))
-                    self.led_thread.start()
-                elif cmd.CMD_SONIC in command_parts:
-                    response_command = cmd.CMD_SONIC + "#" + str(self.ultrasonic_sensor.get_distance()) + "\n"
-                    self.send_data(self.command_connection, response_command)
-                elif cmd.CMD_HEAD in command_parts:
-                    if len(command_parts) == 3:
-                        self.servo_controller.set_servo_angle(int(command_parts[1]), int(command_parts[2]))
-                elif cmd.CMD_CAMERA in command_parts:
-                    if len(command_parts) == 3:
-                        x = self.control_system.restrict_value(int(command_parts[1]), 50, 180)
-                        y = self.control_system.restrict_value(int(command_parts[2]), 0, 180)
-                        self.servo_controller.set_servo_angle(0, x)
-                        self.servo_controller.set_servo_angle(1, y)
-                elif cmd.CMD_RELAX in command_parts:
-                    if self.is_servo_relaxed == False:
-                        self.control_system.relax(True)
-                        self.is_servo_relaxed = True
-                        print("relax")
-                    else:
-                        self.control_system.relax(False)
-                        self.is_servo_relaxed = False
-                        print("unrelax")
-                elif cmd.CMD_SERVOPOWER in command_parts:
-                    if command_parts[1] == "0":
-                        self.control_system.servo_power_disable.on()
-                    else:
-                        self.control_system.servo_power_disable.off()
-
-                else:
-                    self.control_system.command_queue = command_parts
-                    self.control_system.timeout = time.time()
+            elif received_data == b"":
+                break
+            for command in reassembler.feed(received_data):
+                response = self.dispatch_command(command)
+                if response:
+                    self.send_data(self.command_connection, response)
+        self.stop_telemetry_push()
         try:
             if self.led_thread is not None:
                 stop_thread(self.led_thread)
@@ -16,6 +16,12 @@ class Servo:
         self.pwm_41.set_pwm_freq(50)
         time.sleep(0.01)
 
+    def angle_to_duty(self, angle):
+        """Convert an angle in degrees (0-180) to the PCA9685 off tick at 50 Hz."""
+        duty_cycle = map_value(angle, 0, 180, 500, 2500)
+        duty_cycle = map_value(duty_cycle, 0, 20000, 0, 4095)
+        return int(duty_cycle)
+
     def set_servo_angle(self, channel, angle):
         """
         Convert the input angle to the value of PCA9685 and set the servo angle.
@@ -24,21 +30,46 @@ class Servo:
         :param angle: Angle in degrees (0-180)
         """
         if channel < 16:
-            duty_cycle = map_value(angle, 0, 180, 500, 2500)
-            duty_cycle = map_value(duty_cycle, 0, 20000, 0, 4095)
-            self.pwm_41.set_pwm(channel, 0, int(duty_cycle))
+            self.pwm_41.set_pwm(channel, 0, self.angle_to_duty(angle))
         elif channel >= 16 and channel < 32:
-            channel -= 16
-            duty_cycle = map_value(angle, 0, 180, 500, 2500)
-            duty_cycle = map_value(duty_cycle, 0, 20000, 0, 4095)
-            self.pwm_40.set_pwm(channel, 0, int(duty_cycle))
+            self.pwm_40.set_pwm(channel - 16, 0, self.angle_to_duty(angle))
+
+    def set_many(self, angles):
+        """
+        Set several servos at once using auto-increment block writes.
+
+        Consecutive channels on the same board are sent in a single I2C
+        transaction (up to 8 channels each) instead of one per channel.
+
+        :param angles: Dict mapping servo channel (0-31) to angle in degrees (0-180)
+        """
+        boards = ((self.pwm_41, 0), (self.pwm_40, 16))
+        for pwm, base in boards:
+            channels = sorted(channel - base for channel in angles if base <= channel < base + 16)
+            run_start = None
+            run_values = []
+            for channel in channels:
+                if run_start is not None and channel != run_start + len(run_values):
+                    pwm.set_pwm_block(run_start, run_values)
+                    run_start = None
+                    run_values = []
+                if run_start is None:
+                    run_start = channel
+                run_values.append((0, self.angle_to_duty(angles[channel + base])))
+            if run_values:
+                pwm.set_pwm_block(run_start, run_values)
+
+    def get_write_stats(self):
+        """Return how many channel writes were transmitted and skipped across both boards."""
+        return {
+            'writes': self.pwm_40.pwm_writes + self.pwm_41.pwm_writes,
+            'skipped': self.pwm_40.skipped_writes + self.pwm_41.skipped_writes,
+        }
 
     def relax(self):
         """Relax all servos by setting their PWM values to 4096."""
-        for i in range(8):
-            self.pwm_41.set_pwm(i + 8, 4096, 4096)
-            self.pwm_40.set_pwm(i, 4096, 4096)
-            self.pwm_40.set_pwm(i + 8, 4096, 4096)
+        self.pwm_41.set_pwm_block(8, [(4096, 4096)] * 8)
+        self.pwm_40.set_pwm_block(0, [(4096, 4096)] * 16)
 
 
 # Main program logic follows:
@@ -0,0 +1,182 @@
+# -*- coding: utf-8 -*-
+import itertools
+import threading
+import time
+from collections import deque
+from command import COMMAND as cmd
+
+
+def telemetry_message(name: str, value) -> str:
+    """Format one telemetry update as a text protocol line."""
+    if name == 'power':
+        return cmd.CMD_POWER + "#" + str(value[0]) + "#" + str(value[1]) + "\n"
+    if name == 'sonic':
+        return cmd.CMD_SONIC + "#" + str(value) + "\n"
+    return cmd.CMD_IMU + "#" + "#".join(str(round(angle, 1)) for angle in value) + "\n"
+
+
+class Telemetry:
+    """
+    Samples the battery, sonar and IMU on their own schedules and pushes the updates.
+
+    Every reading goes into a shared snapshot of (value, timestamp) pairs and
+    is handed to each subscriber callback as callback(name, value, timestamp).
+    Readers of the snapshot never touch the hardware themselves, so command
+    handling does not wait for I2C or GPIO.
+
+    read() adds a max-age policy on top: a cached sample is returned while
+    it is fresh enough, and only a stale one triggers a live read. Each
+    sensor has a lock, so concurrent callers share one live read and never
+    interleave with the sampler on the bus.
+    """
+
+    def __init__(self, adc, ultrasonic, imu, power_period: float = 2.0, sonic_period: float = 0.2, imu_period: float = 0.05):
+        # name -> (sampling period in seconds, read function)
+        self.sources = {
+            'power': (power_period, adc.read_battery_voltage),
+            'sonic': (sonic_period, ultrasonic.get_distance),
+            'imu': (imu_period, lambda: imu.read_angles(imu_period)),
+        }
+        # name -> seconds a cached sample may be served by read(); two sampling periods by default
+        self.max_ages = {name: 2 * period for name, (period, read) in self.sources.items()}
+        self.read_locks = {name: threading.Lock() for name in self.sources}
+        self.snapshot = {}
+        self.subscribers = {}
+        self.subscriber_ids = itertools.count()
+        self.lock = threading.Lock()
+        self.stop_event = threading.Event()
+        self.thread = None
+
+    def start(self) -> None:
+        """Start the sampling thread."""
+        if self.thread is None or not self.thread.is_alive():
+            self.stop_event.clear()
+            self.thread = threading.Thread(target=self.run, name='telemetry', daemon=True)
+            self.thread.start()
+
+    def stop(self) -> None:
+        """Stop the sampling thread."""
+        self.stop_event.set()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+
+    def subscribe(self, callback) -> int:
+        """Register callback(name, value, timestamp) and return its subscription id."""
+        with self.lock:
+            subscription = next(self.subscriber_ids)
+            self.subscribers[subscription] = callback
+        return subscription
+
+    def unsubscribe(self, subscription: int) -> None:
+        """Remove a subscription; unknown ids are ignored."""
+        with self.lock:
+            self.subscribers.pop(subscription, None)
+
+    def get(self, name: str):
+        """Return the latest (value, timestamp) for a source, or (None, None) before its first sample."""
+        with self.lock:
+            return self.snapshot.get(name, (None, None))
+
+    def read(self, name: str, max_age: float = None):
+        """
+        Return (value, timestamp) for a source, reading the sensor now only if the cached sample is too old.
+
+        :param max_age: Oldest acceptable sample in seconds; defaults to max_ages[name].
+        """
+        if max_age is None:
+            max_age = self.max_ages[name]
+        value, timestamp = self.get(name)
+        if value is not None and time.time() - timestamp <= max_age:
+            return value, timestamp
+        with self.read_locks[name]:
+            # Another caller may have refreshed it while we waited for the lock
+            value, timestamp = self.get(name)
+            if value is not None and time.time() - timestamp <= max_age:
+                return value, timestamp
+            value = self.sources[name][1]()
+            if value is None:
+                return self.get(name)
+            timestamp = time.time()
+            with self.lock:
+                self.snapshot[name] = (value, timestamp)
+        return value, timestamp
+
+    def get_snapshot(self) -> dict:
+        """Return a copy of every latest (value, timestamp) pair."""
+        with self.lock:
+            return dict(self.snapshot)
+
+    def run(self) -> None:
+        """Sample each source when it is due, earliest deadline first."""
+        now = time.monotonic()
+        next_due = {name: now for name in self.sources}
+        while not self.stop_event.is_set():
+            name = min(next_due, key=next_due.get)
+            delay = next_due[name] - time.monotonic()
+            if delay > 0 and self.stop_event.wait(delay):
+                break
+            period, read = self.sources[name]
+            try:
+                with self.read_locks[name]:
+                    value = read()
+            except Exception as e:
+                print(e)
+                value = None
+            now = time.monotonic()
+            # Keep the schedule, but do not try to catch up on missed samples
+            next_due[name] = max(next_due[name] + period, now)
+            if value is None:
+                continue
+            timestamp = time.time()
+            with self.lock:
+                self.snapshot[name] = (value, timestamp)
+                subscribers = list(self.subscribers.values())
+            for callback in subscribers:
+                try:
+                    callback(name, value, timestamp)
+                except Exception as e:
+                    print(e)
+
+
+class TelemetrySender:
+    """
+    Hands telemetry lines to a blocking send function on its own thread.
+
+    push() only appends to a small bounded queue, so a client that stops
+    reading never stalls the sampling thread. When the queue is full the
+    oldest line is dropped and counted; newer samples follow anyway.
+    """
+
+    def __init__(self, send, max_pending: int = 32):
+        self.send = send
+        self.pending = deque(maxlen=max_pending)
+        self.condition = threading.Condition()
+        self.dropped = 0
+        self.closed = False
+        self.thread = threading.Thread(target=self.run, name='telemetry-sender', daemon=True)
+        self.thread.start()
+
+    def push(self, message: str) -> None:
+        """Queue one line without blocking."""
+        with self.condition:
+            if len(self.pending) == self.pending.maxlen:
+                self.dropped += 1
+            self.pending.append(message)
+            self.condition.notify()
+
+    def close(self) -> None:
+        """Stop the sender thread; queued lines are discarded."""
+        with self.condition:
+            self.closed = True
+            self.pending.clear()
+            self.condition.notify()
+
+    def run(self) -> None:
+        while True:
+            with self.condition:
+                self.condition.wait_for(lambda: self.pending or self.closed)
+                if self.closed:
+                    return
+                message = self.pending.popleft()
+            self.send(message)
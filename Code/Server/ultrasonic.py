@@ -1,7 +1,11 @@
 from gpiozero import DistanceSensor, PWMSoftwareFallback, DistanceSensorNoEcho
 import warnings
 import time
+import threading
+from collections import deque
+from statistics import median
 from gpio_utils import release_gpio_pins
+from scheduler import LoopScheduler
 
 class Ultrasonic:
     def __init__(self, trigger_pin: int = 27, echo_pin: int = 22, max_distance: float = 3.0):
@@ -14,6 +18,19 @@ class Ultrasonic:
         # Try to release pins before initializing to prevent 'GPIO busy' errors
         release_gpio_pins([self.trigger_pin, self.echo_pin])
         self.sensor = DistanceSensor(echo=self.echo_pin, trigger=self.trigger_pin, max_distance=self.max_distance)  # Initialize the distance sensor
+        # Background ranging state
+        self.ranging_thread = None
+        self.ranging_stop = threading.Event()
+        self.lock = threading.Lock()
+        self.samples = deque(maxlen=5)     # Recent raw readings for the median filter
+        self.outlier_limit = 50.0          # Readings this far (cm) from the median are treated as outliers
+        self.last_reading = None           # Previous raw reading, accepted or not
+        self.filtered_distance = None
+        self.timestamp = None
+        self.obstacle_threshold = None
+        self.obstacle_callback = None
+        self.obstacle_hysteresis = 5.0     # cm above the threshold before the callback can fire again
+        self.obstacle_active = False
 
     def __enter__(self):
         return self
@@ -25,9 +42,19 @@ class Ultrasonic:
         """
         Get the distance measurement from the ultrasonic sensor.
 
+        While background ranging runs this returns the latest filtered distance without touching the sensor,
+        falling back to a direct reading until the first filtered value exists.
+
         Returns:
         float: The distance measurement in centimeters, rounded to one decimal place.
         """
+        filtered_distance = self.filtered_distance
+        if self.ranging_thread is not None and filtered_distance is not None:
+            return filtered_distance
+        return self.read_raw_distance()
+
+    def read_raw_distance(self) -> float:
+        """Read one distance in centimeters directly from the sensor."""
         try:
             distance = self.sensor.distance * 100  # Get the distance in centimeters
             return round(float(distance), 1)  # Return the distance rounded to one decimal place
@@ -35,8 +62,80 @@ class Ultrasonic:
             print(f"Warning: {e}")
             return None
 
+    def start_ranging(self, rate: float = 10.0, window: int = 5) -> None:
+        """
+        Start measuring in a background thread.
+
+        :param rate: Measurements per second.
+        :param window: Number of recent readings the median filter uses.
+        """
+        if self.ranging_thread is not None:
+            return
+        with self.lock:
+            self.samples = deque(self.samples, maxlen=window)
+        self.ranging_stop.clear()
+        self.ranging_thread = threading.Thread(target=self._ranging_loop, args=(1.0 / rate,), name='ultrasonic', daemon=True)
+        self.ranging_thread.start()
+
+    def stop_ranging(self) -> None:
+        """Stop the background measurements."""
+        if self.ranging_thread is not None:
+            self.ranging_stop.set()
+            self.ranging_thread.join()
+            self.ranging_thread = None
+
+    def get_filtered_distance(self) -> tuple:
+        """Return (distance in cm, time.time() timestamp) of the latest filtered reading, or (None, None)."""
+        with self.lock:
+            return self.filtered_distance, self.timestamp
+
+    def set_obstacle_callback(self, threshold: float, callback) -> None:
+        """
+        Call callback(distance) from the ranging thread when two accepted readings in a row are below threshold (cm).
+
+        It fires once per approach and re-arms after the distance rises above threshold + obstacle_hysteresis.
+        Pass callback=None to remove it.
+        """
+        self.obstacle_threshold = threshold
+        self.obstacle_callback = callback
+        self.obstacle_active = False
+
+    def _ranging_loop(self, period: float) -> None:
+        scheduler = LoopScheduler(period)
+        scheduler.start()
+        while not self.ranging_stop.is_set():
+            distance = self.read_raw_distance()
+            if distance is not None:
+                self._add_sample(distance)
+            scheduler.wait()
+
+    def _add_sample(self, distance: float) -> None:
+        with self.lock:
+            previous = self.last_reading
+            self.last_reading = distance
+            if self.samples and abs(distance - median(self.samples)) > self.outlier_limit:
+                if previous is None or abs(distance - previous) > self.outlier_limit:
+                    return  # A single spike: drop it and keep the window
+                # Two readings in a row agree on a new distance: it is a real jump, restart the window from them
+                self.samples.clear()
+                self.samples.append(previous)
+            self.samples.append(distance)
+            filtered = round(median(self.samples), 1)
+            self.filtered_distance = filtered
+            self.timestamp = time.time()
+            # The obstacle check looks at the last two accepted readings so it does not wait for the median
+            recent = max(self.samples[-1], self.samples[-2]) if len(self.samples) > 1 else distance
+        if self.obstacle_callback is None:
+            return
+        if not self.obstacle_active and recent < self.obstacle_threshold:
+            self.obstacle_active = True
+            self.obstacle_callback(round(recent, 1))
+        elif self.obstacle_active and filtered > self.obstacle_threshold + self.obstacle_hysteresis:
+            self.obstacle_active = False
+
     def close(self):
         # Close the distance sensor.
+        self.stop_ranging()
         self.sensor.close()  # Close the sensor to release resources
 
 if __name__ == '__main__':
@@ -0,0 +1,102 @@
+# -*- coding: utf-8 -*-
+import fcntl
+import struct
+import termios
+import time
+from threading import Lock
+
+
+def unsent_bytes(connection) -> int:
+    """Return how many bytes are still queued in the kernel send buffer of a socket (0 if unknown)."""
+    try:
+        # TIOCOUTQ is SIOCOUTQ for sockets on Linux
+        return struct.unpack('i', fcntl.ioctl(connection.fileno(), termios.TIOCOUTQ, b'\0\0\0\0'))[0]
+    except (OSError, ValueError):
+        return 0
+
+
+class VideoQualityController:
+    """
+    Adapts the video stream to how fast the viewers actually drain it.
+
+    Every frame a sender reports how much was still queued before the send
+    and how long the send stalled. A frame is dropped instead of queued when
+    the previous one has not left the send buffer yet, which keeps latency
+    bounded. Sustained congestion steps the stream down one level (JPEG
+    quality, then frame rate, then resolution); a quiet period steps it back
+    up. The encoder is shared, so the slowest viewer sets the level.
+    """
+
+    # (JPEG quality, stream size, frame rate), best first
+    LEVELS = [
+        (85, (400, 300), 30),
+        (70, (400, 300), 30),
+        (55, (400, 300), 20),
+        (45, (320, 240), 15),
+        (35, (320, 240), 10),
+    ]
+
+    def __init__(self, levels: list = None, min_interval: float = 2.0, recover_after: float = 5.0):
+        self.levels = levels or self.LEVELS
+        self.level = 0
+        self.min_interval = min_interval    # Seconds between two level changes
+        self.recover_after = recover_after  # Seconds without congestion before stepping up
+        self.congestion = 0.0               # Moving average of congested frames, 0..1
+        self.last_change = time.monotonic()
+        self.last_congested = self.last_change
+        self.sent = 0
+        self.dropped = 0
+        self.lock = Lock()
+
+    def current(self) -> tuple:
+        """Return the (quality, stream size, frame rate) of the current level."""
+        return self.levels[self.level]
+
+    def should_send(self, queued_bytes: int, frame_size: int) -> bool:
+        """Return False if the frame should be dropped because the last one is still queued."""
+        return queued_bytes < frame_size
+
+    def report(self, queued_bytes: int, frame_size: int, stall: float, sent: bool = True):
+        """
+        Record one frame and decide whether the stream level should change.
+
+        :param queued_bytes: Bytes still waiting to be sent when the frame was ready.
+        :param frame_size: Size of the frame in bytes.
+        :param stall: Seconds the send blocked.
+        :param sent: False if the frame was dropped.
+        :return: The new (quality, stream size, frame rate) to apply, or None to keep the current one.
+        """
+        with self.lock:
+            now = time.monotonic()
+            period = 1.0 / self.levels[self.level][2]
+            congested = not sent or stall > period / 2 or queued_bytes >= frame_size
+            if sent:
+                self.sent += 1
+            else:
+                self.dropped += 1
+            self.congestion = 0.9 * self.congestion + (0.1 if congested else 0.0)
+            if congested:
+                self.last_congested = now
+            if now - self.last_change < self.min_interval:
+                return None
+            if self.congestion > 0.3 and self.level < len(self.levels) - 1:
+                self.level += 1
+            elif now - self.last_congested >= self.recover_after and self.level > 0:
+                self.level -= 1
+            else:
+                return None
+            self.last_change = now
+            self.congestion = 0.0
+            return self.levels[self.level]
+
+    def get_stats(self) -> dict:
+        """Return the current level and frame counters."""
+        quality, stream_size, frame_rate = self.current()
+        return {
+            'level': self.level,
+            'quality': quality,
+            'stream_size': stream_size,
+            'frame_rate': frame_rate,
+            'sent': self.sent,
+            'dropped': self.dropped,
+        }